@@ -0,0 +1,563 @@
+#!/usr/bin/env python
+""" Load-test harness which measures the overhead of opbeat_pyramid.
+
+A sample Pyramid app is driven with synthetic traffic twice: once without
+`opbeat_pyramid` as a baseline and once with it included, reporting to a local
+fake collector. Each run happens in freshly spawned processes because opbeat
+instruments libraries globally when imported.
+
+The harness exits with a non-zero status when any request gets an unexpected
+response, when the collector receives nothing, or when the instrumented run
+exceeds its profile's overhead budgets:
+
+    python benchmarks/loadtest.py --profile ci
+    python benchmarks/loadtest.py --profile burst --max-p99-added-ms 5
+    python benchmarks/loadtest.py --setting opbeat.trace_rollups=false
+"""
+
+import argparse
+import collections
+import json
+import logging
+import math
+import multiprocessing
+import random
+import resource
+import sys
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+from pyramid import httpexceptions
+from pyramid.config import Configurator
+from pyramid.response import Response
+from webob import Request
+
+
+PROFILES = {
+    # Small enough to run on every change.
+    'ci': {
+        'requests': 4000,
+        'view_ms': 5.0,
+        'warmup': 200,
+        'threads': 4,
+        'processes': 1,
+        'routes': 20,
+        'error_rate': 0.01,
+        'http_exception_rate': 0.05,
+    },
+
+    # Mostly healthy traffic spread over a realistic number of routes.
+    'steady': {
+        'requests': 20000,
+        'view_ms': 5.0,
+        'warmup': 500,
+        'threads': 8,
+        'processes': 2,
+        'routes': 100,
+        'error_rate': 0.005,
+        'http_exception_rate': 0.02,
+    },
+
+    # High-cardinality, error-heavy traffic.
+    'burst': {
+        'requests': 40000,
+        'view_ms': 5.0,
+        'warmup': 500,
+        'threads': 16,
+        'processes': 4,
+        'routes': 5000,
+        'error_rate': 0.05,
+        'http_exception_rate': 0.2,
+    },
+}
+
+
+# About 25% above the worst of several runs of each profile on a single CPU,
+# so that regressions fail. Capturing exceptions accounts for most of the
+# added p99 latency, and `burst` saturates the CPU even without this module,
+# which makes its p99 noisy.
+BUDGETS = {
+    'ci': {
+        'p99_added_ms': 18.0,
+        'throughput_loss': 0.28,
+        'rss_growth_mb': 11.0,
+    },
+
+    'steady': {
+        'p99_added_ms': 48.0,
+        'throughput_loss': 0.57,
+        'rss_growth_mb': 13.0,
+    },
+
+    'burst': {
+        'p99_added_ms': 565.0,
+        'throughput_loss': 0.58,
+        'rss_growth_mb': 10.5,
+    },
+}
+
+
+class SyntheticError(Exception):
+    pass
+
+
+class FakeCollectorHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        self.rfile.read(length)
+
+        kind = self.path.rstrip('/').rsplit('/', 1)[-1]
+
+        with self.server.lock:
+            self.server.received[kind] += 1
+
+        self.send_response(202)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeCollector(ThreadingMixIn, HTTPServer):
+    """ Accepts everything the opbeat client sends, counted by API. """
+
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), FakeCollectorHandler)
+        self.lock = threading.Lock()
+        self.received = collections.Counter()
+
+    @property
+    def url(self):
+        return 'http://%s:%d' % self.server_address
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+
+def view(request):
+    # Stands in for the database and service calls of a real view.
+    time.sleep(request.registry.settings['loadtest.view_ms'] / 1000.0)
+
+    action = request.params.get('action')
+
+    if action == 'error':
+        raise SyntheticError('Synthetic load-test error')
+
+    if action == 'http_exception':
+        raise httpexceptions.HTTPNotFound()
+
+    return Response('ok')
+
+
+def make_app(profile, instrumented, settings):
+    settings = dict(settings, **{'loadtest.view_ms': profile['view_ms']})
+    config = Configurator(settings=settings)
+
+    for index in range(profile['routes']):
+        route_name = 'route_%d' % index
+        config.add_route(route_name, '/route/%d' % index)
+        config.add_view(view, route_name=route_name)
+
+    if instrumented:
+        config.include('opbeat_pyramid')
+
+    return config.make_wsgi_app()
+
+
+def build_plan(profile, count, seed):
+    """ Build a deterministic list of request paths for a traffic profile. """
+
+    rng = random.Random(seed)
+    plan = []
+
+    for _ in range(count):
+        path = '/route/%d' % rng.randrange(profile['routes'])
+        roll = rng.random()
+
+        if roll < profile['error_rate']:
+            path += '?action=error'
+
+        elif roll < profile['error_rate'] + profile['http_exception_rate']:
+            path += '?action=http_exception'
+
+        plan.append(path)
+
+    return plan
+
+
+def read_rss():
+    """ Current resident set size in bytes, or peak RSS where unavailable. """
+
+    try:
+        with open('/proc/self/statm') as statm:
+            pages = int(statm.read().split()[1])
+
+        return pages * resource.getpagesize()
+
+    except (IOError, OSError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        # ru_maxrss is in bytes on macOS and kilobytes elsewhere.
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def get_expected_outcome(path):
+    if path.endswith('action=error'):
+        return 'error'
+
+    if path.endswith('action=http_exception'):
+        return 404
+
+    return 200
+
+
+def send_request(app, path):
+    """ Send a request, returning its status code or 'error' if it raised. """
+
+    try:
+        return Request.blank(path).get_response(app).status_code
+
+    except SyntheticError:
+        return 'error'
+
+    except Exception as exc:
+        return repr(exc)
+
+
+def send_requests(app, paths, latencies, unexpected):
+    for path in paths:
+        started = time.time()
+        outcome = send_request(app, path)
+        latencies.append((time.time() - started) * 1000)
+
+        if outcome != get_expected_outcome(path):
+            unexpected.append('%s: %s' % (path, outcome))
+
+
+def run_worker(job):
+    """ Drive one process's share of the traffic across several threads. """
+
+    profile, instrumented, settings, seed, count = job
+
+    # Reported errors are logged, which shouldn't reach the console here.
+    logging.getLogger().addHandler(logging.NullHandler())
+
+    app = make_app(profile, instrumented, settings)
+    unexpected = []
+
+    send_requests(
+        app,
+        build_plan(profile, profile['warmup'], seed),
+        [],
+        unexpected,
+    )
+
+    plan = build_plan(profile, count, seed + 1)
+    threads = profile['threads']
+    results = [[] for _ in range(threads)]
+
+    workers = [
+        threading.Thread(
+            target=send_requests,
+            args=(app, plan[index::threads], results[index], unexpected),
+        )
+        for index in range(threads)
+    ]
+
+    rss_before = read_rss()
+    started = time.time()
+
+    for worker in workers:
+        worker.start()
+
+    for worker in workers:
+        worker.join()
+
+    elapsed = time.time() - started
+    rss_growth = read_rss() - rss_before
+
+    if instrumented:
+        # Pool workers exit without running atexit hooks.
+        from opbeat_pyramid import subscribers
+        subscribers.flush_opbeat_clients(app.registry)
+
+    latencies = []
+    for result in results:
+        latencies.extend(result)
+
+    return {
+        'latencies': latencies,
+        'elapsed': elapsed,
+        'rss_growth': rss_growth,
+        'unexpected': len(unexpected),
+        'unexpected_samples': unexpected[:5],
+    }
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+
+    ordered = sorted(values)
+    rank = int(math.ceil((pct / 100.0) * len(ordered)))
+    return ordered[max(0, rank - 1)]
+
+
+def summarize(worker_results):
+    latencies = []
+
+    for result in worker_results:
+        latencies.extend(result['latencies'])
+
+    elapsed = max(result['elapsed'] for result in worker_results)
+
+    samples = []
+    for result in worker_results:
+        samples.extend(result['unexpected_samples'])
+
+    return {
+        'requests': len(latencies),
+        'unexpected': sum(result['unexpected'] for result in worker_results),
+        'unexpected_samples': samples[:5],
+        'p50_ms': percentile(latencies, 50),
+        'p99_ms': percentile(latencies, 99),
+        'throughput': len(latencies) / elapsed if elapsed else 0.0,
+        'rss_growth_mb': max(
+            result['rss_growth'] for result in worker_results
+        ) / (1024.0 * 1024.0),
+    }
+
+
+def measure(profile, instrumented, settings, seed):
+    processes = profile['processes']
+    count = profile['requests'] // processes
+
+    jobs = [
+        (profile, instrumented, settings, seed + index * 1000, count)
+        for index in range(processes)
+    ]
+
+    # Spawned processes never share opbeat's global instrumentation.
+    pool = multiprocessing.get_context('spawn').Pool(processes)
+
+    try:
+        return summarize(pool.map(run_worker, jobs))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def check_budgets(baseline, instrumented, budgets):
+    """ Describe every budget which the instrumented run exceeds. """
+
+    failures = []
+
+    p99_added = instrumented['p99_ms'] - baseline['p99_ms']
+    if p99_added > budgets['p99_added_ms']:
+        failures.append('p99 latency grew by %.3fms (budget %.3fms)' % (
+            p99_added,
+            budgets['p99_added_ms'],
+        ))
+
+    if baseline['throughput']:
+        loss = 1 - (instrumented['throughput'] / baseline['throughput'])
+
+        if loss > budgets['throughput_loss']:
+            failures.append('throughput fell by %.1f%% (budget %.1f%%)' % (
+                loss * 100,
+                budgets['throughput_loss'] * 100,
+            ))
+
+    rss_added = instrumented['rss_growth_mb'] - baseline['rss_growth_mb']
+    if rss_added > budgets['rss_growth_mb']:
+        failures.append('RSS grew by %.1fMB more (budget %.1fMB)' % (
+            rss_added,
+            budgets['rss_growth_mb'],
+        ))
+
+    return failures
+
+
+def check_outcomes(results, received, profile):
+    """ Describe anything which shows a run didn't behave as expected.
+
+    Every request must get the response its plan expects, and the collector
+    must have received transactions and, if any were raised, errors.
+    """
+
+    failures = []
+
+    for name in ('baseline', 'instrumented'):
+        result = results[name]
+
+        if result['unexpected']:
+            failures.append('%d %s requests got unexpected responses: %s' % (
+                result['unexpected'],
+                name,
+                '; '.join(result['unexpected_samples']),
+            ))
+
+    if not received['transactions']:
+        failures.append('the collector received no transactions')
+
+    if profile['error_rate'] and not received['errors']:
+        failures.append('the collector received no errors')
+
+    return failures
+
+
+def parse_settings(pairs):
+    settings = {}
+
+    for pair in pairs or []:
+        key, _, value = pair.partition('=')
+        settings[key.strip()] = value.strip()
+
+    return settings
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+
+    parser.add_argument('--profile', choices=sorted(PROFILES), default='ci')
+    parser.add_argument('--requests', type=int)
+    parser.add_argument('--threads', type=int)
+    parser.add_argument('--processes', type=int)
+    parser.add_argument('--routes', type=int)
+    parser.add_argument('--view-ms', type=float)
+    parser.add_argument('--error-rate', type=float)
+    parser.add_argument('--http-exception-rate', type=float)
+    parser.add_argument('--seed', type=int, default=1234)
+
+    parser.add_argument(
+        '--setting',
+        action='append',
+        metavar='KEY=VALUE',
+        help='Extra app setting for the instrumented run.',
+    )
+
+    parser.add_argument(
+        '--max-p99-added-ms',
+        type=float,
+        help='Defaults to the budget of the chosen profile.',
+    )
+
+    parser.add_argument(
+        '--max-throughput-loss',
+        type=float,
+        help='Defaults to the budget of the chosen profile.',
+    )
+
+    parser.add_argument(
+        '--max-rss-growth-mb',
+        type=float,
+        help='Defaults to the budget of the chosen profile.',
+    )
+
+    parser.add_argument('--json', action='store_true')
+
+    return parser
+
+
+def get_profile(args):
+    profile = dict(PROFILES[args.profile])
+
+    for key in profile:
+        override = getattr(args, key, None)
+
+        if override is not None:
+            profile[key] = override
+
+    return profile
+
+
+def get_budgets(args):
+    budgets = dict(BUDGETS[args.profile])
+
+    for key in budgets:
+        override = getattr(args, 'max_' + key, None)
+
+        if override is not None:
+            budgets[key] = override
+
+    return budgets
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    profile = get_profile(args)
+
+    collector = FakeCollector()
+    collector.start()
+
+    settings = {
+        'opbeat.enabled': 'true',
+        'opbeat.module_name': 'loadtest',
+        'opbeat.app_id': 'loadtest',
+        'opbeat.organization_id': 'loadtest',
+        'opbeat.secret_token': 'loadtest',
+        'opbeat.servers': collector.url,
+    }
+
+    settings.update(parse_settings(args.setting))
+
+    try:
+        baseline = measure(profile, False, {}, args.seed)
+        instrumented = measure(profile, True, settings, args.seed)
+    finally:
+        collector.shutdown()
+
+    budgets = get_budgets(args)
+
+    failures = check_outcomes(
+        {'baseline': baseline, 'instrumented': instrumented},
+        collector.received,
+        profile,
+    )
+
+    failures.extend(check_budgets(baseline, instrumented, budgets))
+
+    report = {
+        'profile': profile,
+        'baseline': baseline,
+        'instrumented': instrumented,
+        'budgets': budgets,
+        'received': dict(collector.received),
+        'failures': failures,
+    }
+
+    if args.json:
+        sys.stdout.write(json.dumps(report, indent=2, sort_keys=True) + '\n')
+
+    else:
+        for name in ('baseline', 'instrumented'):
+            result = report[name]
+            sys.stdout.write(
+                '%-12s p50 %.3fms  p99 %.3fms  %.0f req/s  RSS +%.1fMB\n' % (
+                    name,
+                    result['p50_ms'],
+                    result['p99_ms'],
+                    result['throughput'],
+                    result['rss_growth_mb'],
+                )
+            )
+
+        for failure in failures:
+            sys.stdout.write('FAILED: ' + failure + '\n')
+
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
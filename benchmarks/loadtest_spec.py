@@ -0,0 +1,162 @@
+import collections
+import unittest
+
+import loadtest
+
+
+MOCK_PROFILE = {
+    'requests': 100,
+    'warmup': 0,
+    'threads': 2,
+    'processes': 1,
+    'routes': 10,
+    'view_ms': 0.0,
+    'error_rate': 0.1,
+    'http_exception_rate': 0.2,
+}
+
+
+def mock_result(p99_ms=1.0, throughput=1000.0, rss_growth_mb=1.0,
+                unexpected=()):
+    return {
+        'p99_ms': p99_ms,
+        'throughput': throughput,
+        'rss_growth_mb': rss_growth_mb,
+        'unexpected': len(unexpected),
+        'unexpected_samples': list(unexpected),
+    }
+
+
+def mock_received(errors=1, transactions=1):
+    return collections.Counter(errors=errors, transactions=transactions)
+
+
+class LoadTestTestCase(unittest.TestCase):
+    def test_build_plan_is_deterministic_for_a_seed(self):
+        self.assertEqual(
+            loadtest.build_plan(MOCK_PROFILE, 50, seed=1),
+            loadtest.build_plan(MOCK_PROFILE, 50, seed=1),
+        )
+
+    def test_build_plan_follows_the_traffic_mix(self):
+        plan = loadtest.build_plan(MOCK_PROFILE, 10000, seed=1)
+
+        errors = sum(1 for path in plan if path.endswith('=error'))
+        http_exceptions = sum(1 for path in plan if 'http_exception' in path)
+        routes = set(path.split('?')[0] for path in plan)
+
+        self.assertAlmostEqual(errors / 10000.0, 0.1, delta=0.02)
+        self.assertAlmostEqual(http_exceptions / 10000.0, 0.2, delta=0.02)
+        self.assertEqual(len(routes), MOCK_PROFILE['routes'])
+
+    def test_percentile_picks_the_nearest_rank(self):
+        values = list(range(1, 101))
+
+        self.assertEqual(loadtest.percentile(values, 50), 50)
+        self.assertEqual(loadtest.percentile(values, 99), 99)
+        self.assertEqual(loadtest.percentile([], 99), 0.0)
+
+    def test_check_budgets_passes_within_budget(self):
+        self.assertEqual(loadtest.check_budgets(
+            mock_result(),
+            mock_result(p99_ms=2.0, throughput=900.0, rss_growth_mb=5.0),
+            loadtest.BUDGETS['ci'],
+        ), [])
+
+    def test_check_budgets_reports_every_exceeded_budget(self):
+        failures = loadtest.check_budgets(
+            mock_result(),
+            mock_result(p99_ms=100.0, throughput=100.0, rss_growth_mb=100.0),
+            loadtest.BUDGETS['ci'],
+        )
+
+        self.assertEqual(len(failures), 3)
+
+    def test_ci_budgets_fail_when_measured_overhead_doubles(self):
+        # The ci profile measured about +15ms p99 and 22% throughput loss.
+        failures = loadtest.check_budgets(
+            mock_result(p99_ms=6.0, throughput=750.0),
+            mock_result(p99_ms=36.0, throughput=420.0),
+            loadtest.BUDGETS['ci'],
+        )
+
+        self.assertEqual(len(failures), 2)
+
+    def test_get_expected_outcome_follows_the_plan(self):
+        plan = loadtest.build_plan(MOCK_PROFILE, 1000, seed=1)
+        outcomes = set(loadtest.get_expected_outcome(path) for path in plan)
+
+        self.assertEqual(outcomes, set([200, 404, 'error']))
+
+    def test_send_requests_records_unexpected_responses(self):
+        app = loadtest.make_app(MOCK_PROFILE, False, {})
+        unexpected = []
+
+        loadtest.send_requests(app, [
+            '/route/1',
+            '/route/1?action=error',
+            '/route/1?action=http_exception',
+            '/missing',
+        ], [], unexpected)
+
+        self.assertEqual(unexpected, ['/missing: 404'])
+
+    def test_check_outcomes_passes_for_expected_runs(self):
+        self.assertEqual(loadtest.check_outcomes(
+            {'baseline': mock_result(), 'instrumented': mock_result()},
+            mock_received(),
+            MOCK_PROFILE,
+        ), [])
+
+    def test_check_outcomes_reports_unexpected_responses(self):
+        failures = loadtest.check_outcomes({
+            'baseline': mock_result(),
+            'instrumented': mock_result(unexpected=['/route/1: 500']),
+        }, mock_received(), MOCK_PROFILE)
+
+        self.assertEqual(len(failures), 1)
+        self.assertIn('/route/1: 500', failures[0])
+
+    def test_check_outcomes_requires_the_collector_to_receive_events(self):
+        failures = loadtest.check_outcomes(
+            {'baseline': mock_result(), 'instrumented': mock_result()},
+            mock_received(errors=0, transactions=0),
+            MOCK_PROFILE,
+        )
+
+        self.assertEqual(len(failures), 2)
+
+    def test_parse_settings_splits_key_value_pairs(self):
+        self.assertEqual(loadtest.parse_settings([
+            'opbeat.trace_rollups=false',
+            'opbeat.servers = http://localhost:8200',
+        ]), {
+            'opbeat.trace_rollups': 'false',
+            'opbeat.servers': 'http://localhost:8200',
+        })
+
+    def test_get_profile_applies_command_line_overrides(self):
+        args = loadtest.get_parser().parse_args([
+            '--profile', 'burst',
+            '--routes', '7',
+        ])
+
+        profile = loadtest.get_profile(args)
+        self.assertEqual(profile['routes'], 7)
+        self.assertEqual(
+            profile['threads'],
+            loadtest.PROFILES['burst']['threads'],
+        )
+
+    def test_get_budgets_defaults_to_the_profiles_budgets(self):
+        args = loadtest.get_parser().parse_args([
+            '--profile', 'steady',
+            '--max-p99-added-ms', '3',
+        ])
+
+        budgets = loadtest.get_budgets(args)
+        self.assertEqual(budgets['p99_added_ms'], 3.0)
+        self.assertEqual(
+            budgets['throughput_loss'],
+            loadtest.BUDGETS['steady']['throughput_loss'],
+        )
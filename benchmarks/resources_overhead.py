@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+""" Micro-benchmark for the per-request resource accounting toggles.
+
+Each `opbeat.resources.*` setting is timed on its own around a small
+allocating workload, and compared with running the workload unmeasured:
+
+    python benchmarks/resources_overhead.py
+    python benchmarks/resources_overhead.py --requests 50000 --json
+
+Allocation tracing slows down every allocation in the process, not just the
+accounting itself, so its cost grows with how much a request allocates.
+"""
+
+import argparse
+import json
+import sys
+
+from opbeat_pyramid import resources
+from opbeat_pyramid import sampling
+
+
+CONFIGS = (
+    ('baseline', None),
+    ('wall_time', {}),
+    ('cpu_time', {'cpu_time': True}),
+    ('gc', {'gc_pauses': True}),
+    ('allocations', {'allocations': True}),
+    ('all', {'cpu_time': True, 'gc_pauses': True, 'allocations': True}),
+)
+
+
+def workload(size):
+    return [{'index': index} for index in range(size)]
+
+
+def run_config(options, requests, size):
+    tracing = options and options.get('allocations')
+
+    if tracing and not resources.start_tracing_allocations():
+        return None
+
+    try:
+        started = sampling.timer()
+
+        for _ in range(requests):
+            if options is None:
+                workload(size)
+                continue
+
+            usage = resources.ResourceUsage(**options)
+            workload(size)
+            usage.finish()
+
+        return (sampling.timer() - started) / requests
+
+    finally:
+        resources.gc_monitor.uninstall()
+
+        if tracing:
+            resources.tracemalloc.stop()
+
+
+def measure(requests, size):
+    """ Microseconds taken per request by each config, and added by it. """
+
+    results = {}
+    baseline = None
+
+    for name, options in CONFIGS:
+        # Warm up before timing.
+        run_config(options, max(1, requests // 10), size)
+        per_request = run_config(options, requests, size)
+
+        if per_request is None:
+            continue
+
+        if baseline is None:
+            baseline = per_request
+
+        results[name] = {
+            'per_request_us': per_request * 1e6,
+            'added_us': (per_request - baseline) * 1e6,
+        }
+
+    return results
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument(
+        '--allocations-per-request',
+        type=int,
+        default=200,
+        help='Objects allocated by the workload for each request.',
+    )
+
+    parser.add_argument('--json', action='store_true')
+
+    return parser
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    results = measure(args.requests, args.allocations_per_request)
+
+    if args.json:
+        sys.stdout.write(json.dumps(results, indent=2, sort_keys=True) + '\n')
+        return 0
+
+    sys.stdout.write('%-12s %16s %12s\n' % (
+        'setting',
+        'us/request',
+        'added us',
+    ))
+
+    for name, _ in CONFIGS:
+        if name in results:
+            sys.stdout.write('%-12s %16.2f %12.2f\n' % (
+                name,
+                results[name]['per_request_us'],
+                results[name]['added_us'],
+            ))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,25 @@
+import unittest
+
+import resources_overhead
+
+
+class ResourcesOverheadTestCase(unittest.TestCase):
+    def test_measure_reports_every_config(self):
+        results = resources_overhead.measure(requests=10, size=5)
+
+        self.assertEqual(
+            set(results),
+            set(name for name, _ in resources_overhead.CONFIGS),
+        )
+
+        self.assertEqual(results['baseline']['added_us'], 0.0)
+
+    def test_measure_leaves_no_hooks_installed(self):
+        resources_overhead.measure(requests=10, size=5)
+
+        resources = resources_overhead.resources
+
+        self.assertFalse(resources.gc_monitor.installed)
+
+        if resources.tracemalloc is not None:
+            self.assertFalse(resources.tracemalloc.is_tracing())
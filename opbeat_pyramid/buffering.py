@@ -0,0 +1,165 @@
+import logging
+import sys
+import threading
+
+
+DEFAULT_MAX_GROUPS = 500
+DEFAULT_MAX_PENDING = 5000
+DEFAULT_HIGH_WATER_RATIO = 0.8
+DEFAULT_OVERFLOW_ROUTE_NAME = 'Overflow'
+
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_size(value, seen=None):
+    """ Approximate number of bytes used by a value and everything in it. """
+
+    if seen is None:
+        seen = set()
+
+    if id(value) in seen:
+        return 0
+
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+
+    if isinstance(value, dict):
+        for key, item in value.items():
+            size += estimate_size(key, seen) + estimate_size(item, seen)
+
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        for item in value:
+            size += estimate_size(item, seen)
+
+    elif hasattr(value, '__dict__'):
+        size += estimate_size(vars(value), seen)
+
+    return size
+
+
+def store_size(store):
+    """ Approximate number of bytes held by an opbeat `RequestsStore`. """
+
+    with store.cond:
+        return (
+            estimate_size(dict(store._transactions)) +
+            estimate_size(dict(store._traces))
+        )
+
+
+class TransactionBuffer(object):
+    """ Bounds the transactions an opbeat client holds between flushes.
+
+    Transactions are counted per (route, status) group. Once `max_groups`
+    distinct groups are pending, new groups overflow: their traces are dropped
+    and only their duration is reported under `overflow_route_name` until the
+    next flush.
+    """
+
+    def __init__(self,
+                 max_groups=DEFAULT_MAX_GROUPS,
+                 max_pending=DEFAULT_MAX_PENDING,
+                 high_water_ratio=DEFAULT_HIGH_WATER_RATIO,
+                 overflow_route_name=DEFAULT_OVERFLOW_ROUTE_NAME):
+
+        self.max_groups = max_groups
+        self.max_pending = max_pending
+        self.overflow_route_name = overflow_route_name
+
+        self.groups_high_water = max(1, int(max_groups * high_water_ratio))
+        self.pending_high_water = max(1, int(max_pending * high_water_ratio))
+
+        self.lock = threading.Lock()
+        self.groups = {}
+        self.pending = 0
+        self.overflowed = 0
+        self.flushes = 0
+
+    def admit(self, route_name, status_code):
+        """ Count a transaction. Returns False if it overflowed the buffer. """
+
+        key = (route_name, status_code)
+
+        with self.lock:
+            self.pending += 1
+
+            if key in self.groups:
+                self.groups[key] += 1
+                return True
+
+            if len(self.groups) >= self.max_groups:
+                self.overflowed += 1
+                return False
+
+            self.groups[key] = 1
+            return True
+
+    def should_flush(self):
+        return (
+            self.pending >= self.pending_high_water or
+            len(self.groups) >= self.groups_high_water
+        )
+
+    def clear(self, flushed=False):
+        with self.lock:
+            self.groups = {}
+            self.pending = 0
+
+            if flushed:
+                self.flushes += 1
+
+    def metrics(self, store=None):
+        """ Describe the buffer, and the memory used by `store` if given. """
+
+        return {
+            'transaction_buffer.pending': self.pending,
+            'transaction_buffer.groups': len(self.groups),
+            'transaction_buffer.overflowed': self.overflowed,
+            'transaction_buffer.flushes': self.flushes,
+            'transaction_buffer.memory_bytes': (
+                store_size(store) if store is not None else 0
+            ),
+        }
+
+
+class BackgroundFlusher(object):
+    """ Calls `flush` from a background thread whenever it is requested.
+
+    Requests only signal the thread, so at most one flush is ever pending no
+    matter how many requests reach a high-water mark at once.
+    """
+
+    def __init__(self, flush):
+        self.flush = flush
+        self.event = threading.Event()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive():
+                return
+
+            self.thread = threading.Thread(
+                target=self.run,
+                name='opbeat-buffer-flush',
+            )
+
+            self.thread.daemon = True
+            self.thread.start()
+
+    def request_flush(self):
+        self.start()
+        self.event.set()
+
+    def run(self):
+        while True:
+            self.event.wait()
+            self.event.clear()
+
+            try:
+                self.flush()
+
+            except Exception:
+                logger.exception('Failed to flush buffered transactions.')
@@ -0,0 +1,130 @@
+import threading
+import time
+import unittest
+
+from opbeat_pyramid import buffering
+
+
+class MockGroup(object):
+    def __init__(self, durations):
+        self.durations = durations
+
+
+class MockStore(object):
+    def __init__(self):
+        self.cond = threading.Condition()
+        self._transactions = {}
+        self._traces = {}
+
+
+class TransactionBufferTestCase(unittest.TestCase):
+    def setUp(self):
+        self.buffer = buffering.TransactionBuffer(
+            max_groups=4,
+            max_pending=10,
+            high_water_ratio=0.5,
+        )
+
+    def test_admit_counts_transactions_by_route_and_status(self):
+        self.assertTrue(self.buffer.admit('mock.route', 200))
+        self.assertTrue(self.buffer.admit('mock.route', 200))
+        self.assertTrue(self.buffer.admit('mock.route', 500))
+
+        self.assertEqual(self.buffer.pending, 3)
+        self.assertEqual(self.buffer.groups[('mock.route', 200)], 2)
+        self.assertEqual(len(self.buffer.groups), 2)
+
+    def test_admit_degrades_to_counting_when_groups_overflow(self):
+        for index in range(4):
+            self.assertTrue(self.buffer.admit('route.' + str(index), 200))
+
+        self.assertFalse(self.buffer.admit('route.overflow', 200))
+        self.assertTrue(self.buffer.admit('route.0', 200))
+
+        self.assertEqual(self.buffer.overflowed, 1)
+        self.assertEqual(self.buffer.pending, 6)
+        self.assertNotIn(('route.overflow', 200), self.buffer.groups)
+
+    def test_should_flush_at_the_pending_high_water_mark(self):
+        for _ in range(4):
+            self.buffer.admit('mock.route', 200)
+
+        self.assertFalse(self.buffer.should_flush())
+
+        self.buffer.admit('mock.route', 200)
+        self.assertTrue(self.buffer.should_flush())
+
+    def test_should_flush_at_the_groups_high_water_mark(self):
+        self.buffer.admit('route.a', 200)
+        self.assertFalse(self.buffer.should_flush())
+
+        self.buffer.admit('route.b', 200)
+        self.assertTrue(self.buffer.should_flush())
+
+    def test_clear_resets_pending_transactions(self):
+        self.buffer.admit('mock.route', 200)
+
+        self.buffer.clear()
+        self.assertEqual(self.buffer.pending, 0)
+        self.assertEqual(self.buffer.groups, {})
+        self.assertEqual(self.buffer.flushes, 0)
+
+        self.buffer.clear(flushed=True)
+        self.assertEqual(self.buffer.flushes, 1)
+
+    def test_store_size_grows_with_the_store(self):
+        store = MockStore()
+        empty_size = buffering.store_size(store)
+
+        store._transactions['mock.route'] = MockGroup([1.5, 2.5])
+        self.assertGreater(buffering.store_size(store), empty_size)
+
+    def test_metrics_exposes_buffer_state(self):
+        self.buffer.admit('mock.route', 200)
+        metrics = self.buffer.metrics(MockStore())
+
+        self.assertEqual(metrics['transaction_buffer.pending'], 1)
+        self.assertEqual(metrics['transaction_buffer.groups'], 1)
+        self.assertEqual(metrics['transaction_buffer.overflowed'], 0)
+        self.assertGreater(metrics['transaction_buffer.memory_bytes'], 0)
+
+    def test_metrics_without_a_store_reports_no_memory(self):
+        metrics = self.buffer.metrics()
+        self.assertEqual(metrics['transaction_buffer.memory_bytes'], 0)
+
+
+class BackgroundFlusherTestCase(unittest.TestCase):
+    def test_request_flush_flushes_on_another_thread(self):
+        flushed = threading.Event()
+        threads = []
+
+        def flush():
+            threads.append(threading.current_thread())
+            flushed.set()
+
+        flusher = buffering.BackgroundFlusher(flush)
+        flusher.request_flush()
+
+        self.assertTrue(flushed.wait(5))
+        self.assertIsNot(threads[0], threading.current_thread())
+
+    def test_flush_errors_do_not_stop_the_thread(self):
+        flushed = threading.Event()
+        calls = []
+
+        def flush():
+            calls.append(None)
+
+            if len(calls) == 1:
+                raise RuntimeError('mock failure')
+
+            flushed.set()
+
+        flusher = buffering.BackgroundFlusher(flush)
+        flusher.request_flush()
+
+        while not calls:
+            time.sleep(0.01)
+
+        flusher.request_flush()
+        self.assertTrue(flushed.wait(5))
@@ -0,0 +1,360 @@
+import itertools
+import logging
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+try:
+    import reprlib
+except ImportError:
+    import repr as reprlib
+
+
+LOCALS_FULL = 'full'
+LOCALS_OFF = 'off'
+LOCALS_REPR = 'repr'
+LOCALS_ALLOWLIST = 'allowlist'
+
+LOCALS_MODES = (LOCALS_FULL, LOCALS_OFF, LOCALS_REPR, LOCALS_ALLOWLIST)
+
+DEFAULT_MAX_STRING_LENGTH = 400
+DEFAULT_QUEUE_SIZE = 100
+
+TRUNCATION_SUFFIX = '...'
+
+
+logger = logging.getLogger(__name__)
+
+
+def truncate(value, max_length):
+    if not max_length or len(value) <= max_length:
+        return value
+
+    return value[:max_length] + TRUNCATION_SUFFIX
+
+
+class LimitedRepr(reprlib.Repr):
+    """ A `repr` which never renders more of a value than it will keep.
+
+    Strings are cut from the end, like `truncate` does, and containers only
+    render their first items.
+    """
+
+    def __init__(self, max_length):
+        reprlib.Repr.__init__(self)
+
+        max_items = max(1, max_length // 10)
+
+        self.maxstring = max_length
+        self.maxlong = max_length
+        self.maxother = max_length
+        self.maxlist = max_items
+        self.maxtuple = max_items
+        self.maxdict = max_items
+        self.maxset = max_items
+        self.maxfrozenset = max_items
+        self.maxdeque = max_items
+        self.maxarray = max_items
+
+    def repr_str(self, value, level):
+        return repr(value[:self.maxstring + 1])
+
+    repr_bytes = repr_unicode = repr_str
+
+    # `reprlib` sorts dicts and sets in full before rendering a few items.
+    def repr_dict(self, value, level):
+        if not value:
+            return '{}'
+
+        if level <= 0:
+            return '{...}'
+
+        pieces = [
+            '%s: %s' % (
+                self.repr1(key, level - 1),
+                self.repr1(item, level - 1),
+            )
+            for key, item in itertools.islice(value.items(), self.maxdict)
+        ]
+
+        if len(value) > self.maxdict:
+            pieces.append('...')
+
+        return '{%s}' % ', '.join(pieces)
+
+    def repr_set(self, value, level):
+        if not value:
+            return 'set()'
+
+        return self._repr_iterable(value, level, '{', '}', self.maxset)
+
+    def repr_frozenset(self, value, level):
+        if not value:
+            return 'frozenset()'
+
+        return self._repr_iterable(
+            value,
+            level,
+            'frozenset({',
+            '})',
+            self.maxfrozenset,
+        )
+
+    def repr_instance(self, value, level):
+        # Errors are left to `safe_repr`, rather than hidden by `reprlib`.
+        return repr(value)
+
+
+def safe_repr(value, max_length):
+    try:
+        if max_length:
+            result = LimitedRepr(max_length).repr(value)
+        else:
+            result = repr(value)
+
+    except Exception:
+        result = '<unrepresentable %s>' % type(value).__name__
+
+    return truncate(result, max_length)
+
+
+class CapturedFrame(object):
+    """ Stands in for a frame, holding on to only the locals we report.
+
+    Locals are converted with `repr` as soon as the frame is captured, on the
+    thread which raised. Rendering them later from the capture thread would
+    race with the request, which may still be using them.
+    """
+
+    def __init__(self, frame, locals_mode, allowlist, max_string_length):
+        self.f_code = frame.f_code
+        self.f_globals = frame.f_globals
+        self.f_lineno = frame.f_lineno
+        self.f_locals = {}
+
+        if locals_mode == LOCALS_OFF:
+            return
+
+        f_locals = frame.f_locals
+
+        if locals_mode == LOCALS_ALLOWLIST:
+            names = [name for name in allowlist if name in f_locals]
+        else:
+            names = list(f_locals)
+
+        self.f_locals = dict(
+            (name, safe_repr(f_locals[name], max_string_length))
+            for name in names
+        )
+
+    def drop_locals(self):
+        self.f_locals = {}
+
+    def locals_size(self):
+        return sum(
+            len(name) + len(value) for name, value in self.f_locals.items()
+        )
+
+
+class CapturedTraceback(object):
+    def __init__(self, tb_frame, tb_lineno, tb_next=None):
+        self.tb_frame = tb_frame
+        self.tb_lineno = tb_lineno
+        self.tb_next = tb_next
+
+
+def split_exc_info(exc_info):
+    exc_info = tuple(exc_info) + (None, None, None)
+    return exc_info[:3]
+
+
+def is_hidden_frame(frame):
+    try:
+        return bool(frame.f_locals.get('__traceback_hide__'))
+
+    except Exception:
+        return False
+
+
+def snapshot_exc_info(exc_info,
+                      max_frames=0,
+                      locals_mode=LOCALS_FULL,
+                      allowlist=(),
+                      max_string_length=DEFAULT_MAX_STRING_LENGTH,
+                      max_payload_bytes=0,
+                      in_background=False):
+    """ Copy the parts of `exc_info` which should be sent to opbeat.
+
+    The innermost `max_frames` frames are kept. Full locals are captured as
+    `repr`s when they are sent `in_background`, so that live frames never
+    reach another thread, and with a `max_payload_bytes` budget, so that they
+    can be measured. Otherwise, with the default settings, `exc_info` is
+    returned untouched.
+    """
+
+    exc_type, exc_value, traceback = split_exc_info(exc_info)
+
+    if locals_mode == LOCALS_FULL and (max_payload_bytes or in_background):
+        locals_mode = LOCALS_REPR
+
+    if locals_mode == LOCALS_FULL and not max_frames:
+        return exc_info
+
+    entries = []
+
+    while traceback is not None:
+        if not is_hidden_frame(traceback.tb_frame):
+            entries.append((traceback.tb_frame, traceback.tb_lineno))
+
+        traceback = traceback.tb_next
+
+    if max_frames:
+        entries = entries[-max_frames:]
+
+    captured = None
+
+    for frame, lineno in reversed(entries):
+        if locals_mode == LOCALS_FULL:
+            tb_frame = frame
+        else:
+            tb_frame = CapturedFrame(
+                frame,
+                locals_mode,
+                allowlist,
+                max_string_length,
+            )
+
+        captured = CapturedTraceback(tb_frame, lineno, captured)
+
+    return exc_type, exc_value, captured
+
+
+def iter_captured_frames(exc_info):
+    traceback = split_exc_info(exc_info)[2]
+
+    while traceback is not None:
+        if isinstance(traceback.tb_frame, CapturedFrame):
+            yield traceback.tb_frame
+
+        traceback = traceback.tb_next
+
+
+def limit_extra(extra, max_string_length):
+    result = {}
+
+    for key, value in extra.items():
+        if isinstance(value, str):
+            value = truncate(value, max_string_length)
+
+        result[key] = value
+
+    return result
+
+
+def extra_size(extra):
+    return sum(len(str(key)) + len(str(value)) for key, value in extra.items())
+
+
+def fit_payload(exc_info, extra, max_payload_bytes):
+    """ Drop details until the captured locals and extra fit the budget.
+
+    Locals are dropped from the outermost frames first, followed by the
+    largest extra values. Frames must have been captured with the same
+    budget, so that every frame's locals can be measured.
+    """
+
+    if not max_payload_bytes:
+        return extra
+
+    frames = list(iter_captured_frames(exc_info))
+    size = extra_size(extra) + sum(frame.locals_size() for frame in frames)
+
+    for frame in frames:
+        if size <= max_payload_bytes:
+            return extra
+
+        size -= frame.locals_size()
+        frame.drop_locals()
+
+    extra = dict(extra)
+    largest_first = sorted(
+        extra,
+        key=lambda key: len(str(extra[key])),
+        reverse=True,
+    )
+
+    for key in largest_first:
+        if size <= max_payload_bytes:
+            break
+
+        size -= len(str(key)) + len(str(extra.pop(key)))
+
+    return extra
+
+
+class CaptureWorker(object):
+    """ Sends captured exceptions to opbeat from a background thread.
+
+    Work is dropped rather than queued without bound when the worker falls
+    behind.
+    """
+
+    def __init__(self, max_queue_size=DEFAULT_QUEUE_SIZE):
+        self.queue = queue.Queue(max_queue_size)
+        self.lock = threading.Lock()
+        self.thread = None
+        self.dropped = 0
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive():
+                return
+
+            self.thread = threading.Thread(
+                target=self.run,
+                name='opbeat-capture',
+            )
+
+            self.thread.daemon = True
+            self.thread.start()
+
+    def submit(self, func, *args):
+        self.start()
+
+        try:
+            self.queue.put_nowait((func, args))
+
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+        return True
+
+    def run(self):
+        while True:
+            func, args = self.queue.get()
+
+            try:
+                func(*args)
+
+            except Exception:
+                logger.exception('Failed to capture exception for opbeat.')
+
+            finally:
+                self.queue.task_done()
+
+    def pending(self):
+        return self.queue.qsize()
+
+    def drain(self, timeout):
+        """ Wait up to `timeout` seconds for queued work to be sent. """
+
+        done = threading.Thread(target=self.queue.join)
+        done.daemon = True
+        done.start()
+        done.join(timeout)
+
+        return not done.is_alive()
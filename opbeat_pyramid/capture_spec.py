@@ -0,0 +1,254 @@
+import mock
+import sys
+import threading
+import unittest
+
+from opbeat_pyramid import capture
+
+
+def raise_nested_error(depth):
+    secret = 'hunter2'
+    payload = 'x' * 1000
+
+    if depth:
+        return raise_nested_error(depth - 1)
+
+    raise ValueError(secret + payload)
+
+
+def get_exc_info(depth=3):
+    try:
+        raise_nested_error(depth)
+    except ValueError:
+        return sys.exc_info()
+
+
+def iter_frames(exc_info):
+    traceback = exc_info[2]
+
+    while traceback is not None:
+        yield traceback.tb_frame
+        traceback = traceback.tb_next
+
+
+class OpbeatCaptureTestCase(unittest.TestCase):
+    def test_snapshot_exc_info_is_a_noop_by_default(self):
+        exc_info = get_exc_info()
+        self.assertIs(capture.snapshot_exc_info(exc_info), exc_info)
+
+    def test_snapshot_exc_info_keeps_the_innermost_frames(self):
+        exc_info = get_exc_info(depth=5)
+        snapshot = capture.snapshot_exc_info(exc_info, max_frames=2)
+
+        frames = list(iter_frames(snapshot))
+
+        self.assertEqual(len(frames), 2)
+        self.assertIs(snapshot[1], exc_info[1])
+        self.assertEqual(frames[-1].f_code.co_name, 'raise_nested_error')
+        self.assertIn('payload', frames[-1].f_locals)
+
+    def test_snapshot_exc_info_can_drop_locals(self):
+        snapshot = capture.snapshot_exc_info(
+            get_exc_info(),
+            locals_mode=capture.LOCALS_OFF,
+        )
+
+        for frame in iter_frames(snapshot):
+            self.assertEqual(frame.f_locals, {})
+
+    def test_snapshot_exc_info_truncates_locals_when_captured(self):
+        class Recorder(object):
+            reprs = 0
+
+            def __repr__(self):
+                Recorder.reprs += 1
+                return 'recorder'
+
+        def raise_with_recorder():
+            recorder = Recorder()  # noqa
+            raise ValueError()
+
+        try:
+            raise_with_recorder()
+        except ValueError:
+            exc_info = sys.exc_info()
+
+        snapshot = capture.snapshot_exc_info(
+            exc_info,
+            locals_mode=capture.LOCALS_REPR,
+        )
+
+        # Rendered straight away, rather than from the capture thread.
+        self.assertEqual(Recorder.reprs, 1)
+
+        frame = list(iter_frames(snapshot))[-1]
+        self.assertEqual(frame.f_locals['recorder'], 'recorder')
+
+        snapshot = capture.snapshot_exc_info(
+            get_exc_info(),
+            locals_mode=capture.LOCALS_REPR,
+            max_string_length=10,
+        )
+
+        frame = list(iter_frames(snapshot))[-1]
+        self.assertEqual(frame.f_locals['payload'], "'xxxxxxxxx...")
+        self.assertEqual(frame.f_locals['secret'], "'hunter2'")
+
+    def test_snapshot_exc_info_measures_full_locals_with_a_budget(self):
+        snapshot = capture.snapshot_exc_info(
+            get_exc_info(depth=2),
+            max_payload_bytes=100,
+        )
+
+        frames = list(capture.iter_captured_frames(snapshot))
+
+        self.assertEqual(len(frames), len(list(iter_frames(snapshot))))
+        self.assertIn('payload', frames[-1].f_locals)
+
+        capture.fit_payload(snapshot, {}, 100)
+        self.assertEqual(frames[-1].f_locals, {})
+
+    def test_snapshot_exc_info_only_keeps_allowlisted_locals(self):
+        snapshot = capture.snapshot_exc_info(
+            get_exc_info(),
+            locals_mode=capture.LOCALS_ALLOWLIST,
+            allowlist=['depth'],
+        )
+
+        frame = list(iter_frames(snapshot))[-1]
+        self.assertEqual(frame.f_locals, {'depth': '0'})
+
+    def test_snapshot_exc_info_skips_hidden_frames(self):
+        def hidden():
+            __traceback_hide__ = True  # noqa
+            raise ValueError()
+
+        try:
+            hidden()
+        except ValueError:
+            exc_info = sys.exc_info()
+
+        snapshot = capture.snapshot_exc_info(exc_info, max_frames=10)
+        names = [frame.f_code.co_name for frame in iter_frames(snapshot)]
+        self.assertNotIn('hidden', names)
+
+    def test_safe_repr_never_renders_large_values_in_full(self):
+        class Counted(object):
+            reprs = 0
+
+            def __repr__(self):
+                Counted.reprs += 1
+                return 'counted'
+
+        values = [Counted() for _ in range(1000)]
+        result = capture.safe_repr(values, 100)
+
+        self.assertEqual(Counted.reprs, 10)
+        self.assertTrue(result.startswith('[counted, counted'))
+        self.assertLessEqual(len(result), 100 + len('...'))
+
+        self.assertEqual(capture.safe_repr('x' * 10000, 5), "'xxxx...")
+        self.assertEqual(
+            capture.safe_repr({'key': 'value'}, 100),
+            "{'key': 'value'}",
+        )
+
+        self.assertEqual(
+            capture.safe_repr(dict((key, 0) for key in range(100)), 20),
+            '{0: 0, 1: 0, ...}',
+        )
+
+        self.assertEqual(capture.safe_repr(set(), 20), 'set()')
+        self.assertEqual(
+            capture.safe_repr(frozenset([1]), 20),
+            'frozenset({1})',
+        )
+
+    def test_snapshot_exc_info_copies_full_locals_for_the_background(self):
+        snapshot = capture.snapshot_exc_info(
+            get_exc_info(),
+            in_background=True,
+        )
+
+        frames = list(iter_frames(snapshot))
+
+        self.assertEqual(
+            len(list(capture.iter_captured_frames(snapshot))),
+            len(frames),
+        )
+
+        self.assertIn('payload', frames[-1].f_locals)
+
+    def test_safe_repr_handles_broken_reprs(self):
+        class Broken(object):
+            def __repr__(self):
+                raise RuntimeError()
+
+        self.assertEqual(
+            capture.safe_repr(Broken(), 100),
+            '<unrepresentable Broken>',
+        )
+
+    def test_limit_extra_truncates_strings(self):
+        self.assertEqual(
+            capture.limit_extra({'url': 'x' * 20, 'count': 20}, 5),
+            {'url': 'xxxxx...', 'count': 20},
+        )
+
+    def test_fit_payload_drops_outer_locals_then_large_extra(self):
+        snapshot = capture.snapshot_exc_info(
+            get_exc_info(depth=2),
+            locals_mode=capture.LOCALS_REPR,
+            max_string_length=2000,
+        )
+
+        extra = {'small': 'a', 'large': 'b' * 500}
+        frames = list(capture.iter_captured_frames(snapshot))
+
+        result = capture.fit_payload(snapshot, extra, 1600)
+
+        self.assertEqual(result, extra)
+        self.assertEqual(frames[0].f_locals, {})
+        self.assertNotEqual(frames[-1].f_locals, {})
+
+        result = capture.fit_payload(snapshot, extra, 100)
+
+        self.assertEqual(result, {'small': 'a'})
+        self.assertEqual(frames[-1].f_locals, {})
+
+    def test_fit_payload_is_a_noop_without_a_budget(self):
+        extra = {'large': 'b' * 500}
+        self.assertIs(capture.fit_payload(get_exc_info(), extra, 0), extra)
+
+    def test_capture_worker_runs_work_in_the_background(self):
+        worker = capture.CaptureWorker()
+        threads = []
+
+        def work(value):
+            threads.append((threading.current_thread(), value))
+
+        self.assertTrue(worker.submit(work, 'value'))
+        self.assertTrue(worker.drain(1))
+
+        self.assertEqual(threads[0][1], 'value')
+        self.assertIsNot(threads[0][0], threading.current_thread())
+
+    def test_capture_worker_drops_work_when_full(self):
+        worker = capture.CaptureWorker(max_queue_size=1)
+        release = threading.Event()
+
+        worker.submit(release.wait, 5)
+
+        try:
+            # Wait for the worker to pick up the first item.
+            while worker.pending():
+                pass
+
+            self.assertTrue(worker.submit(mock.MagicMock()))
+            self.assertFalse(worker.submit(mock.MagicMock()))
+            self.assertEqual(worker.dropped, 1)
+
+        finally:
+            release.set()
+
+        self.assertTrue(worker.drain(1))
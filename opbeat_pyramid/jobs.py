@@ -0,0 +1,100 @@
+import functools
+
+from opbeat import traces
+from pyramid import threadlocal
+
+from opbeat_pyramid import propagation
+from opbeat_pyramid import subscribers
+
+
+DEFAULT_JOB_KIND = 'task'
+NESTED_JOB_KIND = 'code.job'
+JOB_SUCCESS_STATUS = 'success'
+JOB_FAILURE_STATUS = 'failure'
+
+
+class job_transaction(object):
+    """ Records non-request work as an opbeat transaction.
+
+    Usable as a context manager or as a decorator. The request defaults to
+    the current threadlocal request, which `pyramid.paster.bootstrap` sets up
+    for scripts and workers sharing the application's registry.
+
+        env = bootstrap('production.ini')
+
+        with job_transaction('reports.nightly', request=env['request']):
+            build_nightly_reports()
+
+    Exceptions raised by the job are reported to opbeat and then re-raised.
+
+    Jobs run while another transaction is active on the same thread, such as
+    a job called from a view, are recorded as a trace within that transaction
+    instead of as a transaction of their own.
+    """
+
+    def __init__(self, name, request=None, kind=DEFAULT_JOB_KIND):
+        self.name = name
+        self.request = request
+        self.kind = kind
+        self.active_request = None
+        self.nested_trace = None
+        self.previous_context = None
+
+    def get_request(self):
+        if self.request is not None:
+            return self.request
+
+        return threadlocal.get_current_request()
+
+    def __enter__(self):
+        request = self.get_request()
+
+        if request is None or not subscribers.is_opbeat_enabled(request):
+            return self
+
+        if traces.get_transaction() is not None:
+            self.nested_trace = traces.trace(self.name, NESTED_JOB_KIND)
+            self.nested_trace.__enter__()
+            return self
+
+        self.active_request = request
+        self.previous_context = propagation.get_current_context()
+        subscribers.begin_transaction(request, self.kind, state=self)
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        nested_trace, self.nested_trace = self.nested_trace, None
+
+        if nested_trace is not None:
+            # The enclosing transaction reports any exception it sees.
+            nested_trace.__exit__(exc_type, exc_value, traceback)
+            return False
+
+        request, self.active_request = self.active_request, None
+
+        if request is None:
+            return False
+
+        if exc_type is None:
+            status = JOB_SUCCESS_STATUS
+
+        else:
+            status = JOB_FAILURE_STATUS
+            subscribers.handle_exception(
+                request,
+                (exc_type, exc_value, traceback),
+            )
+
+        subscribers.end_transaction(request, self.name, status, state=self)
+        propagation.set_current_context(self.previous_context)
+
+        return False
+
+    def __call__(self, job):
+        @functools.wraps(job)
+        def job_with_transaction(*args, **kwargs):
+            with job_transaction(self.name, self.request, self.kind):
+                return job(*args, **kwargs)
+
+        return job_with_transaction
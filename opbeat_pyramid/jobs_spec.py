@@ -0,0 +1,142 @@
+import mock
+import unittest
+
+from opbeat import traces
+from pyramid import testing
+
+from opbeat_pyramid import jobs
+from opbeat_pyramid import propagation
+from opbeat_pyramid import subscribers
+
+
+class OpbeatJobsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.config = testing.setUp()
+        self.request = testing.DummyRequest(self.config)
+
+        self.request.registry.settings = {
+            'opbeat.enabled': 'true',
+            'opbeat.module_name': 'mock',
+            'opbeat.app_id': 'mock app id',
+            'opbeat.secret_token': 'mock secret token',
+            'opbeat.organization_id': 'mock organization id',
+        }
+
+    def tearDown(self):
+        testing.tearDown()
+
+    @mock.patch('opbeat_pyramid.subscribers.end_transaction')
+    @mock.patch('opbeat_pyramid.subscribers.begin_transaction')
+    def test_job_transaction_records_successful_jobs(self, begin, end):
+        with jobs.job_transaction('mock.job', request=self.request) as job:
+            begin.assert_called_once_with(self.request, 'task', state=job)
+            end.assert_not_called()
+
+        end.assert_called_once_with(
+            self.request,
+            'mock.job',
+            'success',
+            state=job,
+        )
+
+    @mock.patch('opbeat_pyramid.subscribers.handle_exception')
+    @mock.patch('opbeat_pyramid.subscribers.end_transaction')
+    @mock.patch('opbeat_pyramid.subscribers.begin_transaction')
+    def test_job_transaction_reports_and_reraises_failures(
+        self, begin, end, handle_exception,
+    ):
+        error = ValueError()
+
+        def break_shit():
+            with jobs.job_transaction('mock.job', request=self.request):
+                raise error
+
+        self.assertRaises(ValueError, break_shit)
+
+        handle_exception.assert_called_once()
+        self.assertIs(handle_exception.call_args[0][1][1], error)
+        self.assertEqual(
+            end.call_args[0],
+            (self.request, 'mock.job', 'failure'),
+        )
+
+    @mock.patch('opbeat_pyramid.subscribers.begin_transaction')
+    def test_job_transaction_is_a_noop_if_opbeat_disabled(self, begin):
+        self.request.registry.settings['opbeat.enabled'] = 'false'
+
+        with jobs.job_transaction('mock.job', request=self.request):
+            pass
+
+        begin.assert_not_called()
+
+    @mock.patch('opbeat_pyramid.subscribers.end_transaction')
+    @mock.patch('opbeat_pyramid.subscribers.begin_transaction')
+    def test_job_transaction_uses_the_threadlocal_request(self, begin, end):
+        self.config.begin(request=self.request)
+
+        try:
+            with jobs.job_transaction('mock.job'):
+                pass
+        finally:
+            self.config.end()
+
+        self.assertEqual(begin.call_args[0], (self.request, 'task'))
+
+    @mock.patch('opbeat_pyramid.subscribers.end_transaction')
+    @mock.patch('opbeat_pyramid.subscribers.begin_transaction')
+    def test_job_transaction_decorates_jobs(self, begin, end):
+        @jobs.job_transaction('mock.job', request=self.request, kind='batch')
+        def job(value):
+            return value * 2
+
+        self.assertEqual(job(21), 42)
+        self.assertEqual(begin.call_args[0], (self.request, 'batch'))
+        self.assertEqual(
+            end.call_args[0],
+            (self.request, 'mock.job', 'success'),
+        )
+
+    @mock.patch('opbeat.Client')
+    def test_jobs_leave_the_requests_transaction_alone(self, Client):
+        client = Client.return_value
+        subscribers.begin_transaction(self.request, 'web')
+
+        with mock.patch('opbeat.traces.get_transaction', return_value=None):
+            with jobs.job_transaction('mock.job', request=self.request):
+                pass
+
+        self.assertIs(self.request._opbeat_client, client)
+
+        subscribers.end_transaction(self.request, 'mock.view', 200)
+        client.end_transaction.assert_any_call('mock.job', 'success')
+        client.end_transaction.assert_any_call('mock.view', 200)
+
+    @mock.patch('opbeat_pyramid.subscribers.begin_transaction')
+    def test_jobs_inside_a_transaction_are_recorded_as_traces(self, begin):
+        transaction = traces.Transaction(0.0, list, client=None)
+
+        with mock.patch('opbeat.traces.get_transaction',
+                        return_value=transaction):
+            with jobs.job_transaction('mock.job', request=self.request):
+                pass
+
+        begin.assert_not_called()
+        self.assertEqual(
+            [(trace.signature, trace.kind)
+             for trace in transaction.transaction_traces],
+            [('mock.job', jobs.NESTED_JOB_KIND)],
+        )
+
+    @mock.patch('opbeat.Client')
+    def test_jobs_restore_the_previous_trace_context(self, Client):
+        context = propagation.context_from_environ({})
+        propagation.set_current_context(context)
+
+        try:
+            with jobs.job_transaction('mock.job', request=self.request):
+                pass
+
+            self.assertIs(propagation.get_current_context(), context)
+
+        finally:
+            propagation.set_current_context(None)
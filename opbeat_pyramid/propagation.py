@@ -0,0 +1,158 @@
+import collections
+import functools
+import random
+import re
+import threading
+
+
+TRACEPARENT_HEADER = 'traceparent'
+TRACEPARENT_ENVIRON_KEY = 'HTTP_TRACEPARENT'
+
+SAMPLED_FLAG = 0x01
+
+
+_TRACEPARENT = re.compile(
+    r'^([0-9a-f]{2})-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$'
+)
+
+_INVALID_TRACE_ID = '0' * 32
+_INVALID_SPAN_ID = '0' * 16
+
+_local = threading.local()
+
+
+TraceContext = collections.namedtuple(
+    'TraceContext',
+    'trace_id parent_id span_id sampled',
+)
+
+
+def generate_trace_id():
+    return '%032x' % random.getrandbits(128)
+
+
+def generate_span_id():
+    return '%016x' % random.getrandbits(64)
+
+
+def parse_traceparent(header):
+    """ Parse a W3C traceparent header into (trace_id, parent_id, sampled).
+
+    Returns None when the header is missing or malformed.
+    """
+
+    if not header:
+        return None
+
+    match = _TRACEPARENT.match(header.strip().lower())
+
+    if not match:
+        return None
+
+    version, trace_id, parent_id, flags = match.groups()
+
+    if version == 'ff':
+        return None
+
+    if trace_id == _INVALID_TRACE_ID or parent_id == _INVALID_SPAN_ID:
+        return None
+
+    return trace_id, parent_id, bool(int(flags, 16) & SAMPLED_FLAG)
+
+
+def format_traceparent(context):
+    flags = SAMPLED_FLAG if context.sampled else 0
+    return '00-%s-%s-%02x' % (context.trace_id, context.span_id, flags)
+
+
+def context_from_environ(environ, sampled=True):
+    """ Continue the trace described by a WSGI environ, or start a new one.
+
+    `sampled` is only used when no upstream decision exists, so that a trace
+    is either sampled end to end or not at all. It may be a callable, which
+    is then only called for new traces.
+    """
+
+    parsed = parse_traceparent(environ.get(TRACEPARENT_ENVIRON_KEY))
+
+    if parsed is None:
+        if callable(sampled):
+            sampled = sampled()
+
+        return TraceContext(
+            trace_id=generate_trace_id(),
+            parent_id=None,
+            span_id=generate_span_id(),
+            sampled=sampled,
+        )
+
+    trace_id, parent_id, upstream_sampled = parsed
+
+    return TraceContext(
+        trace_id=trace_id,
+        parent_id=parent_id,
+        span_id=generate_span_id(),
+        sampled=upstream_sampled,
+    )
+
+
+def get_current_context():
+    return getattr(_local, 'context', None)
+
+
+def set_current_context(context):
+    _local.context = context
+
+
+def inject_headers(headers):
+    """ Add the current thread's trace context to outgoing HTTP headers. """
+
+    context = get_current_context()
+
+    if context is None:
+        return headers
+
+    headers = dict(headers or {})
+
+    for name in headers:
+        if name.lower() == TRACEPARENT_HEADER:
+            return headers
+
+    headers[TRACEPARENT_HEADER] = format_traceparent(context)
+    return headers
+
+
+def wrap_urlopen(urlopen):
+    @functools.wraps(urlopen)
+    def urlopen_with_trace_context(self, method, url, *args, **kwargs):
+        # urlopen(method, url, body=None, headers=None, ...)
+        if len(args) > 1:
+            args = (args[0], inject_headers(args[1])) + args[2:]
+        else:
+            kwargs['headers'] = inject_headers(kwargs.get('headers'))
+
+        return urlopen(self, method, url, *args, **kwargs)
+
+    urlopen_with_trace_context._opbeat_trace_context = True
+    return urlopen_with_trace_context
+
+
+def instrument():
+    """ Propagate trace context through outbound urllib3 and requests calls.
+
+    requests sends through urllib3, so patching the connection pool covers
+    both libraries.
+    """
+
+    try:
+        from urllib3 import connectionpool
+    except ImportError:
+        return False
+
+    pool_class = connectionpool.HTTPConnectionPool
+
+    if getattr(pool_class.urlopen, '_opbeat_trace_context', False):
+        return True
+
+    pool_class.urlopen = wrap_urlopen(pool_class.urlopen)
+    return True
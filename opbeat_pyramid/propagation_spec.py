@@ -0,0 +1,128 @@
+import mock
+import unittest
+
+from opbeat_pyramid import propagation
+
+
+MOCK_TRACE_ID = '4bf92f3577b34da6a3ce929d0e0e4736'
+MOCK_PARENT_ID = '00f067aa0ba902b7'
+MOCK_TRACEPARENT = '00-' + MOCK_TRACE_ID + '-' + MOCK_PARENT_ID + '-01'
+
+
+class PropagationTestCase(unittest.TestCase):
+    def tearDown(self):
+        propagation.set_current_context(None)
+
+    def test_parse_traceparent_returns_ids_and_sampled_flag(self):
+        self.assertEqual(
+            propagation.parse_traceparent(MOCK_TRACEPARENT),
+            (MOCK_TRACE_ID, MOCK_PARENT_ID, True),
+        )
+
+        self.assertEqual(
+            propagation.parse_traceparent(MOCK_TRACEPARENT[:-2] + '00'),
+            (MOCK_TRACE_ID, MOCK_PARENT_ID, False),
+        )
+
+    def test_parse_traceparent_rejects_invalid_headers(self):
+        invalid_headers = [
+            None,
+            '',
+            'garbage',
+            'ff' + MOCK_TRACEPARENT[2:],
+            '00-' + '0' * 32 + '-' + MOCK_PARENT_ID + '-01',
+            '00-' + MOCK_TRACE_ID + '-' + '0' * 16 + '-01',
+        ]
+
+        for header in invalid_headers:
+            self.assertIsNone(propagation.parse_traceparent(header))
+
+    def test_context_from_environ_continues_upstream_traces(self):
+        context = propagation.context_from_environ({
+            'HTTP_TRACEPARENT': MOCK_TRACEPARENT[:-2] + '00',
+        })
+
+        self.assertEqual(context.trace_id, MOCK_TRACE_ID)
+        self.assertEqual(context.parent_id, MOCK_PARENT_ID)
+        self.assertNotEqual(context.span_id, MOCK_PARENT_ID)
+        self.assertFalse(context.sampled)
+
+    def test_context_from_environ_starts_a_new_trace_without_header(self):
+        context = propagation.context_from_environ({}, sampled=False)
+
+        self.assertEqual(len(context.trace_id), 32)
+        self.assertEqual(len(context.span_id), 16)
+        self.assertIsNone(context.parent_id)
+        self.assertFalse(context.sampled)
+
+    def test_format_traceparent_round_trips(self):
+        context = propagation.context_from_environ({})
+        parsed = propagation.parse_traceparent(
+            propagation.format_traceparent(context),
+        )
+
+        self.assertEqual(parsed, (context.trace_id, context.span_id, True))
+
+    def test_inject_headers_is_a_noop_without_a_context(self):
+        headers = {'Accept': 'text/html'}
+        self.assertIs(propagation.inject_headers(headers), headers)
+
+    def test_inject_headers_adds_traceparent_header(self):
+        context = propagation.context_from_environ({})
+        propagation.set_current_context(context)
+
+        headers = propagation.inject_headers({'Accept': 'text/html'})
+
+        self.assertEqual(headers['Accept'], 'text/html')
+        self.assertEqual(
+            headers['traceparent'],
+            propagation.format_traceparent(context),
+        )
+
+    def test_inject_headers_keeps_existing_traceparent_header(self):
+        propagation.set_current_context(propagation.context_from_environ({}))
+
+        headers = propagation.inject_headers({'TraceParent': 'existing'})
+        self.assertEqual(headers, {'TraceParent': 'existing'})
+
+    def test_wrap_urlopen_injects_headers_passed_by_keyword(self):
+        propagation.set_current_context(propagation.context_from_environ({}))
+        urlopen = mock.MagicMock()
+
+        wrapped = propagation.wrap_urlopen(urlopen)
+        wrapped('pool', 'GET', '/', headers={'Accept': 'text/html'})
+
+        headers = urlopen.call_args[1]['headers']
+        self.assertIn('traceparent', headers)
+        self.assertEqual(headers['Accept'], 'text/html')
+
+    def test_wrap_urlopen_injects_headers_passed_positionally(self):
+        propagation.set_current_context(propagation.context_from_environ({}))
+        urlopen = mock.MagicMock()
+
+        wrapped = propagation.wrap_urlopen(urlopen)
+        wrapped('pool', 'GET', '/', 'body', {}, 'retries')
+
+        args = urlopen.call_args[0]
+        self.assertEqual(args[:4], ('pool', 'GET', '/', 'body'))
+        self.assertIn('traceparent', args[4])
+        self.assertEqual(args[5], 'retries')
+
+    def test_instrument_only_wraps_urlopen_once(self):
+        try:
+            from urllib3 import connectionpool
+        except ImportError:
+            self.skipTest('urllib3 is not installed')
+
+        pool_class = connectionpool.HTTPConnectionPool
+        original = pool_class.urlopen
+
+        try:
+            self.assertTrue(propagation.instrument())
+            wrapped = pool_class.urlopen
+
+            self.assertTrue(propagation.instrument())
+            self.assertIs(pool_class.urlopen, wrapped)
+
+        finally:
+            pool_class.urlopen = original
@@ -0,0 +1,195 @@
+import gc
+import threading
+import time
+import weakref
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+def _rusage_thread_time():
+    usage = resource.getrusage(resource.RUSAGE_THREAD)
+    return usage.ru_utime + usage.ru_stime
+
+
+if hasattr(time, 'thread_time'):
+    thread_time = time.thread_time
+
+elif resource is not None and hasattr(resource, 'RUSAGE_THREAD'):
+    thread_time = _rusage_thread_time
+
+else:
+    thread_time = None
+
+
+class GCMonitor(object):
+    """ Counts garbage collections and the time spent in them.
+
+    Collections pause every thread, so each request in flight during a
+    collection is charged for the whole pause.
+    """
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.installed = False
+        self.started_at = None
+        self.collections = 0
+        self.pause_time = 0.0
+
+    def __call__(self, phase, info):
+        if phase == 'start':
+            self.started_at = self.clock()
+
+        elif phase == 'stop' and self.started_at is not None:
+            self.collections += 1
+            self.pause_time += self.clock() - self.started_at
+            self.started_at = None
+
+    def install(self):
+        callbacks = getattr(gc, 'callbacks', None)
+
+        if callbacks is None:
+            return False
+
+        with self.lock:
+            if not self.installed:
+                callbacks.append(self)
+                self.installed = True
+
+        return True
+
+    def uninstall(self):
+        with self.lock:
+            if self.installed:
+                gc.callbacks.remove(self)
+                self.installed = False
+
+    def snapshot(self):
+        return self.collections, self.pause_time
+
+
+gc_monitor = GCMonitor()
+
+
+class PeakMonitor(object):
+    """ Shares tracemalloc's process-wide peak between measured requests.
+
+    The peak is only reset when no other measured request is in flight, and
+    only reported for requests which didn't overlap any other one. Requests
+    which are never finished stop counting once they are garbage collected.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active = weakref.WeakSet()
+        self.starts = 0
+
+    def start(self, usage):
+        """ Returns a token for `finish`, or None if the peak is in use. """
+
+        if not hasattr(tracemalloc, 'reset_peak'):
+            return None
+
+        with self.lock:
+            self.starts += 1
+            alone = not self.active
+            self.active.add(usage)
+
+            if not alone:
+                return None
+
+            tracemalloc.reset_peak()
+            return self.starts
+
+    def finish(self, usage, token):
+        """ Whether the peak since `start` belongs to `usage` alone. """
+
+        with self.lock:
+            self.active.discard(usage)
+            return token is not None and token == self.starts
+
+
+peak_monitor = PeakMonitor()
+
+
+def start_tracing_allocations():
+    if tracemalloc is None:
+        return False
+
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+    return True
+
+
+class ResourceUsage(object):
+    """ Measures the resources used between `__init__` and `finish`. """
+
+    def __init__(self, cpu_time=False, gc_pauses=False, allocations=False,
+                 clock=time.time):
+
+        self.clock = clock
+        self.thread = threading.current_thread()
+        self.started_at = clock()
+
+        self.cpu_started_at = None
+        if cpu_time and thread_time is not None:
+            self.cpu_started_at = thread_time()
+
+        self.gc_started_at = None
+        if gc_pauses and gc_monitor.install():
+            self.gc_started_at = gc_monitor.snapshot()
+
+        self.memory_started_at = None
+        self.peak_token = None
+        if allocations and tracemalloc is not None:
+            if tracemalloc.is_tracing():
+                self.memory_started_at = tracemalloc.get_traced_memory()[0]
+                self.peak_token = peak_monitor.start(self)
+
+    def finish(self):
+        result = {
+            'resources.wall_time': (self.clock() - self.started_at) * 1000,
+        }
+
+        # Thread CPU time can't be compared across threads.
+        same_thread = threading.current_thread() is self.thread
+
+        if self.cpu_started_at is not None and same_thread:
+            cpu_time = thread_time() - self.cpu_started_at
+            result['resources.cpu_time'] = cpu_time * 1000
+
+        if self.gc_started_at is not None:
+            collections, pause_time = gc_monitor.snapshot()
+            started_collections, started_pause_time = self.gc_started_at
+
+            result['resources.gc_collections'] = (
+                collections - started_collections
+            )
+
+            result['resources.gc_pause_time'] = (
+                (pause_time - started_pause_time) * 1000
+            )
+
+        if self.memory_started_at is not None and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+
+            result['resources.allocated_bytes'] = (
+                current - self.memory_started_at
+            )
+
+            if peak_monitor.finish(self, self.peak_token):
+                result['resources.peak_allocated_bytes'] = max(
+                    0,
+                    peak - self.memory_started_at,
+                )
+
+        return result
@@ -0,0 +1,170 @@
+import gc
+import mock
+import threading
+import unittest
+
+from opbeat_pyramid import resources
+
+
+class MockClock(object):
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class GCMonitorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = MockClock()
+        self.monitor = resources.GCMonitor(clock=self.clock)
+
+    def tearDown(self):
+        self.monitor.uninstall()
+
+    def test_counts_collections_and_pause_time(self):
+        self.monitor('start', {'generation': 0})
+        self.clock.advance(0.25)
+        self.monitor('stop', {'generation': 0})
+
+        self.assertEqual(self.monitor.snapshot(), (1, 0.25))
+
+    def test_ignores_stops_without_a_start(self):
+        self.monitor('stop', {'generation': 0})
+        self.assertEqual(self.monitor.snapshot(), (0, 0.0))
+
+    def test_install_registers_a_single_callback(self):
+        if not hasattr(gc, 'callbacks'):
+            self.skipTest('gc.callbacks is not available.')
+
+        self.assertTrue(self.monitor.install())
+        self.assertTrue(self.monitor.install())
+        self.assertEqual(gc.callbacks.count(self.monitor), 1)
+
+        gc.collect()
+        self.assertGreater(self.monitor.collections, 0)
+
+        self.monitor.uninstall()
+        self.assertNotIn(self.monitor, gc.callbacks)
+
+
+class ResourceUsageTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = MockClock()
+
+    def test_reports_wall_time_only_by_default(self):
+        usage = resources.ResourceUsage(clock=self.clock)
+        self.clock.advance(0.5)
+
+        self.assertEqual(usage.finish(), {'resources.wall_time': 500.0})
+
+    @mock.patch('opbeat_pyramid.resources.thread_time')
+    def test_reports_thread_cpu_time(self, thread_time):
+        thread_time.side_effect = [1.0, 1.125]
+
+        usage = resources.ResourceUsage(cpu_time=True, clock=self.clock)
+        self.assertEqual(usage.finish()['resources.cpu_time'], 125.0)
+
+    @mock.patch('opbeat_pyramid.resources.thread_time')
+    def test_skips_cpu_time_when_finished_on_another_thread(self,
+                                                            thread_time):
+        thread_time.return_value = 1.0
+        usage = resources.ResourceUsage(cpu_time=True, clock=self.clock)
+        results = []
+
+        worker = threading.Thread(target=lambda: results.append(
+            usage.finish()
+        ))
+        worker.start()
+        worker.join()
+
+        self.assertNotIn('resources.cpu_time', results[0])
+
+    @mock.patch('opbeat_pyramid.resources.gc_monitor')
+    def test_reports_gc_pauses_during_the_request(self, gc_monitor):
+        gc_monitor.install.return_value = True
+        gc_monitor.snapshot.side_effect = [(3, 0.5), (5, 0.75)]
+
+        result = resources.ResourceUsage(gc_pauses=True).finish()
+
+        self.assertEqual(result['resources.gc_collections'], 2)
+        self.assertEqual(result['resources.gc_pause_time'], 250.0)
+
+    @mock.patch('opbeat_pyramid.resources.gc_monitor')
+    def test_skips_gc_pauses_without_gc_callbacks(self, gc_monitor):
+        gc_monitor.install.return_value = False
+
+        result = resources.ResourceUsage(gc_pauses=True).finish()
+        self.assertNotIn('resources.gc_collections', result)
+
+    @mock.patch('opbeat_pyramid.resources.tracemalloc')
+    def test_reports_allocation_deltas(self, tracemalloc):
+        tracemalloc.is_tracing.return_value = True
+        tracemalloc.get_traced_memory.side_effect = [
+            (1000, 5000),
+            (1500, 3000),
+        ]
+
+        result = resources.ResourceUsage(allocations=True).finish()
+
+        tracemalloc.reset_peak.assert_called_once_with()
+        self.assertEqual(result['resources.allocated_bytes'], 500)
+        self.assertEqual(result['resources.peak_allocated_bytes'], 2000)
+
+    @mock.patch('opbeat_pyramid.resources.tracemalloc')
+    def test_only_reports_peaks_of_requests_which_did_not_overlap(
+        self,
+        tracemalloc,
+    ):
+        tracemalloc.is_tracing.return_value = True
+        tracemalloc.get_traced_memory.return_value = (1000, 5000)
+
+        first = resources.ResourceUsage(allocations=True)
+        second = resources.ResourceUsage(allocations=True)
+
+        # The first request's peak is never reset from under it.
+        tracemalloc.reset_peak.assert_called_once_with()
+
+        self.assertNotIn(
+            'resources.peak_allocated_bytes',
+            second.finish(),
+        )
+
+        result = first.finish()
+        self.assertEqual(result['resources.allocated_bytes'], 0)
+        self.assertNotIn('resources.peak_allocated_bytes', result)
+
+        result = resources.ResourceUsage(allocations=True).finish()
+        self.assertEqual(result['resources.peak_allocated_bytes'], 4000)
+
+    @mock.patch('opbeat_pyramid.resources.tracemalloc')
+    def test_unfinished_requests_stop_holding_the_peak(self, tracemalloc):
+        tracemalloc.is_tracing.return_value = True
+        tracemalloc.get_traced_memory.return_value = (1000, 5000)
+
+        resources.ResourceUsage(allocations=True)
+        gc.collect()
+
+        result = resources.ResourceUsage(allocations=True).finish()
+        self.assertIn('resources.peak_allocated_bytes', result)
+
+    @mock.patch('opbeat_pyramid.resources.tracemalloc')
+    def test_skips_allocations_unless_tracing(self, tracemalloc):
+        tracemalloc.is_tracing.return_value = False
+
+        result = resources.ResourceUsage(allocations=True).finish()
+        self.assertNotIn('resources.allocated_bytes', result)
+
+    @mock.patch('opbeat_pyramid.resources.tracemalloc')
+    def test_start_tracing_allocations_starts_tracemalloc_once(self,
+                                                               tracemalloc):
+        tracemalloc.is_tracing.return_value = False
+        self.assertTrue(resources.start_tracing_allocations())
+
+        tracemalloc.is_tracing.return_value = True
+        self.assertTrue(resources.start_tracing_allocations())
+
+        tracemalloc.start.assert_called_once_with()
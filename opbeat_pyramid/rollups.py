@@ -0,0 +1,116 @@
+import numbers
+import re
+
+
+DB_TRACE_KIND_PREFIX = 'db.'
+HTTP_TRACE_KIND_PREFIX = 'ext.http.'
+
+DEFAULT_N_PLUS_ONE_THRESHOLD = 10
+
+DETAILS_COUNT_KEY = 'transactions'
+
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+_VALUE_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_query(sql):
+    """ Replace literals in a SQL query so that repeated queries compare. """
+
+    sql = _STRING_LITERAL.sub('?', sql)
+    sql = _NUMBER_LITERAL.sub('?', sql)
+    sql = _VALUE_LIST.sub('(?)', sql)
+    return _WHITESPACE.sub(' ', sql).strip()
+
+
+def get_query_text(trace):
+    extra = trace.extra or {}
+    return extra.get('sql') or trace.signature
+
+
+def summarize_traces(traces,
+                     n_plus_one_threshold=DEFAULT_N_PLUS_ONE_THRESHOLD):
+    """ Roll up database and outbound HTTP traces for a single transaction.
+
+    Queries which run more than `n_plus_one_threshold` times once normalized
+    are listed under `db.n_plus_one` along with their count.
+    """
+
+    db_count = 0
+    db_duration = 0.0
+    http_count = 0
+    http_duration = 0.0
+    query_counts = {}
+
+    for trace in traces:
+        kind = trace.kind or ''
+        duration = trace.trace_duration or 0.0
+
+        if kind.startswith(DB_TRACE_KIND_PREFIX):
+            db_count += 1
+            db_duration += duration
+
+            query = normalize_query(get_query_text(trace))
+            query_counts[query] = query_counts.get(query, 0) + 1
+
+        elif kind.startswith(HTTP_TRACE_KIND_PREFIX):
+            http_count += 1
+            http_duration += duration
+
+    n_plus_one = dict(
+        (query, count)
+        for query, count in query_counts.items()
+        if count > n_plus_one_threshold
+    )
+
+    return {
+        'db.count': db_count,
+        'db.duration': db_duration,
+        'db.n_plus_one': n_plus_one,
+        'http.count': http_count,
+        'http.duration': http_duration,
+    }
+
+
+def is_number(value):
+    return (
+        isinstance(value, numbers.Number) and
+        not isinstance(value, bool)
+    )
+
+
+def merge_value(total, value):
+    if isinstance(value, dict):
+        merged = dict(total) if isinstance(total, dict) else {}
+
+        for key, item in value.items():
+            merged[key] = merge_value(merged.get(key), item)
+
+        return merged
+
+    if is_number(total) and is_number(value):
+        return total + value
+
+    if value is None:
+        return total
+
+    return value
+
+
+def merge_details(totals, details):
+    """ Add one transaction's details to the totals for its route.
+
+    Numbers are summed, including those in nested dicts such as
+    `db.n_plus_one`, and anything else keeps its latest value. The number of
+    transactions added is kept under `transactions`.
+    """
+
+    result = dict(totals)
+    result[DETAILS_COUNT_KEY] = totals.get(DETAILS_COUNT_KEY, 0) + 1
+
+    for key, value in details.items():
+        result[key] = merge_value(result.get(key), value)
+
+    return result
@@ -0,0 +1,89 @@
+import mock
+import unittest
+
+from opbeat_pyramid import rollups
+
+
+def mock_trace(kind, duration, signature='mock', sql=None):
+    trace = mock.MagicMock()
+    trace.kind = kind
+    trace.trace_duration = duration
+    trace.signature = signature
+    trace.extra = {'sql': sql} if sql else None
+    return trace
+
+
+class RollupsTestCase(unittest.TestCase):
+    def test_normalize_query_replaces_literals(self):
+        self.assertEqual(
+            rollups.normalize_query(
+                "SELECT *  FROM users\n WHERE id = 12 AND name = 'o''hai'",
+            ),
+            'SELECT * FROM users WHERE id = ? AND name = ?',
+        )
+
+    def test_normalize_query_collapses_value_lists(self):
+        self.assertEqual(
+            rollups.normalize_query('SELECT * FROM users WHERE id IN (1, 2)'),
+            rollups.normalize_query('SELECT * FROM users WHERE id IN (3)'),
+        )
+
+    def test_summarize_traces_rolls_up_db_and_http_traces(self):
+        summary = rollups.summarize_traces([
+            mock_trace('db.postgresql.sql', 2.0, sql='SELECT 1'),
+            mock_trace('db.postgresql.sql', 3.0, sql='SELECT 2'),
+            mock_trace('ext.http.requests', 10.0),
+            mock_trace('template.jinja2', 100.0),
+            mock_trace('transaction', 500.0),
+        ])
+
+        self.assertEqual(summary['db.count'], 2)
+        self.assertEqual(summary['db.duration'], 5.0)
+        self.assertEqual(summary['http.count'], 1)
+        self.assertEqual(summary['http.duration'], 10.0)
+        self.assertEqual(summary['db.n_plus_one'], {})
+
+    def test_summarize_traces_flags_repeated_normalized_queries(self):
+        traces = [
+            mock_trace('db.sqlite.sql', 1.0, sql='SELECT * FROM t WHERE id=' +
+                       str(index))
+            for index in range(4)
+        ]
+
+        summary = rollups.summarize_traces(traces, n_plus_one_threshold=3)
+        self.assertEqual(summary['db.n_plus_one'], {
+            'SELECT * FROM t WHERE id=?': 4,
+        })
+
+        summary = rollups.summarize_traces(traces, n_plus_one_threshold=4)
+        self.assertEqual(summary['db.n_plus_one'], {})
+
+    def test_summarize_traces_falls_back_to_trace_signature(self):
+        traces = [mock_trace('db.redis', 1.0, signature='GET') for _ in '12']
+
+        summary = rollups.summarize_traces(traces, n_plus_one_threshold=1)
+        self.assertEqual(summary['db.n_plus_one'], {'GET': 2})
+
+    def test_merge_details_sums_numbers_and_keeps_the_latest_values(self):
+        totals = rollups.merge_details({}, {
+            'db.count': 2,
+            'db.n_plus_one': {'SELECT ?': 11},
+            'response.closed': False,
+            'trace.id': 'a',
+        })
+
+        totals = rollups.merge_details(totals, {
+            'db.count': 3,
+            'db.n_plus_one': {'SELECT ?': 12, 'DELETE ?': 20},
+            'response.time_to_first_byte': None,
+            'trace.id': 'b',
+        })
+
+        self.assertEqual(totals, {
+            'transactions': 2,
+            'db.count': 5,
+            'db.n_plus_one': {'SELECT ?': 23, 'DELETE ?': 20},
+            'response.closed': False,
+            'response.time_to_first_byte': None,
+            'trace.id': 'b',
+        })
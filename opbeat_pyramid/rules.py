@@ -0,0 +1,224 @@
+import fnmatch
+import heapq
+import re
+import shlex
+
+
+RULE_KEYS = ('path', 'route', 'status', 'exception', 'user_agent')
+
+# Transactions are skipped before routing, so only these are known.
+SKIP_RULE_KEYS = ('path', 'user_agent')
+
+DEFAULT_ERROR_STATUS = 500
+
+_GLOB_CHARACTERS = re.compile(r'[*?\[]')
+
+
+def is_glob(pattern):
+    return bool(_GLOB_CHARACTERS.search(pattern))
+
+
+def get_literal_prefix(pattern):
+    """ The part of a glob before its first wildcard. """
+
+    return _GLOB_CHARACTERS.split(pattern, 1)[0]
+
+
+def compile_glob(pattern):
+    """ Compile a glob once, rather than on every match. """
+
+    if pattern is None:
+        return None
+
+    return re.compile(fnmatch.translate(pattern)).match
+
+
+def parse_statuses(value):
+    """ Parse `404`, `400-499`, `4xx` or a comma-separated mix of them. """
+
+    statuses = set()
+
+    for part in value.split(','):
+        part = part.strip().lower()
+
+        if len(part) == 3 and part.endswith('xx') and part[0].isdigit():
+            start = int(part[0]) * 100
+            statuses.update(range(start, start + 100))
+
+        elif '-' in part:
+            start, _, end = part.partition('-')
+            statuses.update(range(int(start), int(end) + 1))
+
+        else:
+            statuses.add(int(part))
+
+    return frozenset(statuses)
+
+
+def get_class_paths(exc_type):
+    """ Dotted paths of an exception class and all of its bases. """
+
+    return tuple(
+        cls.__module__ + '.' + cls.__name__
+        for cls in getattr(exc_type, '__mro__', ())
+    )
+
+
+class Rule(object):
+    """ A set of conditions which must all match for the rule to apply. """
+
+    def __init__(self, path=None, route=None, status=None, exception=None,
+                 user_agent=None, source=''):
+
+        self.path = path
+        self.route = route
+        self.statuses = parse_statuses(status) if status else None
+        self.exception = exception
+        self.user_agent = user_agent.lower() if user_agent else None
+        self.source = source
+
+        self.path_match = compile_glob(self.path)
+        self.route_match = compile_glob(self.route)
+        self.user_agent_match = compile_glob(self.user_agent)
+
+    def matches(self, path, route_name, status, class_paths, user_agent):
+        if self.statuses is not None and status not in self.statuses:
+            return False
+
+        if self.exception is not None and self.exception not in class_paths:
+            return False
+
+        if self.path is not None:
+            if path is None or not self.path_match(path):
+                return False
+
+        if self.route is not None:
+            if not route_name or not self.route_match(route_name):
+                return False
+
+        if self.user_agent is not None:
+            if not self.user_agent_match((user_agent or '').lower()):
+                return False
+
+        return True
+
+
+def parse_rule(line, allowed_keys=RULE_KEYS):
+    """ Parse a line of space-separated `key:value` conditions. """
+
+    conditions = {}
+
+    for token in shlex.split(line):
+        key, separator, value = token.partition(':')
+
+        if not separator or not value:
+            raise ValueError('Invalid ignore rule condition: ' + token)
+
+        if key not in allowed_keys:
+            raise ValueError(
+                'Unknown ignore rule condition "' + key + '". Expected one '
+                'of: ' + ', '.join(allowed_keys)
+            )
+
+        conditions[key] = value
+
+    return Rule(source=line, **conditions)
+
+
+def parse_rules(lines, allowed_keys=RULE_KEYS):
+    return [
+        parse_rule(line, allowed_keys)
+        for line in lines
+        if line.strip() and not line.strip().startswith('#')
+    ]
+
+
+class RuleMatcher(object):
+    """ Finds the first rule matching a request or exception.
+
+    Rules are indexed by exception class, status code, literal path and the
+    literal prefix of path globs, so only the rules which could apply are
+    evaluated.
+    """
+
+    def __init__(self, rules):
+        self.rules = list(rules)
+
+        self.by_exception = {}
+        self.by_status = {}
+        self.by_path = {}
+        self.by_path_prefix = {}
+        self.unindexed = []
+
+        for index, rule in enumerate(self.rules):
+            entry = (index, rule)
+
+            if rule.exception is not None:
+                self.by_exception.setdefault(rule.exception, []).append(entry)
+
+            elif rule.statuses is not None:
+                for status in rule.statuses:
+                    self.by_status.setdefault(status, []).append(entry)
+
+            elif rule.path is not None and not is_glob(rule.path):
+                self.by_path.setdefault(rule.path, []).append(entry)
+
+            elif rule.path is not None and get_literal_prefix(rule.path):
+                prefix = get_literal_prefix(rule.path)
+                self.by_path_prefix.setdefault(prefix, []).append(entry)
+
+            else:
+                self.unindexed.append(entry)
+
+        self.path_prefix_lengths = sorted(set(
+            len(prefix) for prefix in self.by_path_prefix
+        ))
+
+    def __bool__(self):
+        return bool(self.rules)
+
+    __nonzero__ = __bool__
+
+    def candidates(self, path, status, class_paths):
+        sources = [self.unindexed]
+
+        for class_path in class_paths:
+            sources.append(self.by_exception.get(class_path))
+
+        sources.append(self.by_status.get(status))
+
+        if path is not None:
+            sources.append(self.by_path.get(path))
+
+            for length in self.path_prefix_lengths:
+                if length > len(path):
+                    break
+
+                sources.append(self.by_path_prefix.get(path[:length]))
+
+        sources = [source for source in sources if source]
+
+        if len(sources) < 2:
+            return sources[0] if sources else ()
+
+        # Each index is already in the order rules were configured in.
+        return heapq.merge(*sources)
+
+    def match(self, path=None, route_name=None, status=None, exc_type=None,
+              user_agent=None):
+
+        if not self.rules:
+            return None
+
+        class_paths = get_class_paths(exc_type) if exc_type else ()
+
+        for _, rule in self.candidates(path, status, class_paths):
+            if rule.matches(path, route_name, status, class_paths,
+                            user_agent):
+                return rule
+
+        return None
+
+
+def compile_rules(lines, allowed_keys=RULE_KEYS):
+    return RuleMatcher(parse_rules(lines, allowed_keys))
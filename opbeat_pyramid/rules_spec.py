@@ -0,0 +1,143 @@
+import functools
+import unittest
+
+from pyramid import httpexceptions
+
+from opbeat_pyramid import rules
+
+
+class ExpectedError(ValueError):
+    pass
+
+
+class OpbeatRulesTestCase(unittest.TestCase):
+    def test_parse_statuses_supports_codes_ranges_and_classes(self):
+        self.assertEqual(rules.parse_statuses('404'), {404})
+        self.assertEqual(rules.parse_statuses('404,410'), {404, 410})
+        self.assertEqual(rules.parse_statuses('500-502'), {500, 501, 502})
+        self.assertEqual(rules.parse_statuses('4xx'), set(range(400, 500)))
+
+    def test_parse_rule_rejects_unknown_conditions(self):
+        parse = functools.partial(rules.parse_rule, 'colour:blue')
+        self.assertRaises(ValueError, parse)
+
+    def test_parse_rule_rejects_conditions_without_a_value(self):
+        parse = functools.partial(rules.parse_rule, 'path:')
+        self.assertRaises(ValueError, parse)
+
+    def test_parse_rule_restricts_conditions_to_allowed_keys(self):
+        parse = functools.partial(
+            rules.parse_rule,
+            'status:404',
+            rules.SKIP_RULE_KEYS,
+        )
+
+        self.assertRaises(ValueError, parse)
+
+    def test_parse_rules_skips_blank_lines_and_comments(self):
+        parsed = rules.parse_rules(['', '# health checks', 'path:/health'])
+
+        self.assertEqual(len(parsed), 1)
+        self.assertEqual(parsed[0].path, '/health')
+
+    def test_parse_rule_supports_quoted_values(self):
+        rule = rules.parse_rule('user_agent:"*Pingdom Bot*"')
+        self.assertEqual(rule.user_agent, '*pingdom bot*')
+
+    def test_get_class_paths_includes_base_classes(self):
+        class_paths = rules.get_class_paths(ExpectedError)
+
+        self.assertEqual(class_paths[0], __name__ + '.ExpectedError')
+        self.assertIn('builtins.ValueError', class_paths)
+
+    def test_matcher_is_falsy_without_rules(self):
+        matcher = rules.compile_rules([])
+
+        self.assertFalse(matcher)
+        self.assertIsNone(matcher.match(path='/', status=404))
+
+    def test_matcher_requires_every_condition_of_a_rule(self):
+        matcher = rules.compile_rules(['path:/static/* status:404'])
+
+        self.assertIsNotNone(matcher.match(path='/static/a.css', status=404))
+        self.assertIsNone(matcher.match(path='/static/a.css', status=500))
+        self.assertIsNone(matcher.match(path='/api/users', status=404))
+
+    def test_matcher_matches_exception_subclasses(self):
+        matcher = rules.compile_rules([
+            'exception:pyramid.httpexceptions.HTTPClientError',
+        ])
+
+        self.assertIsNotNone(matcher.match(
+            exc_type=httpexceptions.HTTPNotFound,
+        ))
+
+        self.assertIsNone(matcher.match(exc_type=ValueError))
+        self.assertIsNone(matcher.match())
+
+    def test_matcher_matches_route_and_user_agent_globs(self):
+        matcher = rules.compile_rules([
+            'route:admin.*',
+            'user_agent:*pingdom*',
+        ])
+
+        self.assertIsNotNone(matcher.match(route_name='admin.users'))
+        self.assertIsNotNone(matcher.match(user_agent='Pingdom.com_bot'))
+        self.assertIsNone(matcher.match(route_name='home', user_agent='curl'))
+
+    def test_matcher_matches_literal_paths_through_the_index(self):
+        matcher = rules.compile_rules(['path:/health'])
+
+        self.assertIn('/health', matcher.by_path)
+        self.assertEqual(matcher.unindexed, [])
+        self.assertIsNotNone(matcher.match(path='/health'))
+        self.assertIsNone(matcher.match(path='/healthy'))
+
+    def test_matcher_only_evaluates_candidate_rules(self):
+        matcher = rules.compile_rules([
+            'status:404',
+            'exception:builtins.KeyError',
+            'path:/health',
+            'path:/static/*',
+        ])
+
+        candidates = matcher.candidates(
+            '/users',
+            500,
+            ('builtins.ValueError',),
+        )
+        self.assertEqual(list(candidates), [])
+
+        candidates = matcher.candidates(
+            '/static/app.js',
+            404,
+            ('builtins.KeyError',),
+        )
+        self.assertEqual([index for index, _ in candidates], [0, 1, 3])
+
+    def test_matcher_indexes_path_globs_by_literal_prefix(self):
+        matcher = rules.compile_rules([
+            'path:/static/*',
+            'path:/st*',
+            'path:*.png',
+        ])
+
+        self.assertEqual(sorted(matcher.by_path_prefix), ['/st', '/static/'])
+        self.assertEqual(len(matcher.unindexed), 1)
+
+        rule = matcher.match(path='/static/app.js')
+        self.assertEqual(rule.source, 'path:/static/*')
+
+        rule = matcher.match(path='/status')
+        self.assertEqual(rule.source, 'path:/st*')
+
+        rule = matcher.match(path='/logo.png')
+        self.assertEqual(rule.source, 'path:*.png')
+
+        self.assertIsNone(matcher.match(path='/s'))
+
+    def test_matcher_returns_the_first_configured_rule(self):
+        matcher = rules.compile_rules(['path:/*', 'status:404'])
+        rule = matcher.match(path='/missing', status=404)
+
+        self.assertEqual(rule.source, 'path:/*')
@@ -0,0 +1,182 @@
+import random
+import re
+import threading
+import time
+
+
+DEFAULT_WINDOW = 10.0
+DEFAULT_MIN_RATE = 0.001
+DEFAULT_MIN_PER_ROUTE = 1
+DEFAULT_RARE_ROUTE_SHARE = 0.5
+DEFAULT_MAX_ROUTES = 10000
+DEFAULT_SMOOTHING = 0.5
+
+timer = getattr(time, 'perf_counter', time.time)
+
+_ID_SEGMENT = re.compile(r'/[^/]*[0-9][^/]*')
+ID_PLACEHOLDER = '/*'
+
+
+def get_path_key(path):
+    """ Group paths which differ only by IDs, such as `/users/1`.
+
+    Any path segment containing a digit is replaced, which is far cheaper
+    than finding the route a request will match before Pyramid routes it.
+    Other unique paths, such as slugs, still get keys of their own.
+    """
+
+    return _ID_SEGMENT.sub(ID_PLACEHOLDER, path)
+
+
+class AdaptiveSampler(object):
+    """ Adjusts the transaction sample rate to hold a budget.
+
+    Budgets are checked at the end of every `window` seconds. They can be a
+    number of sampled transactions per second, a fraction of wall time spent
+    in this module's own hooks, or both. The next window's rate is the
+    highest one that keeps every budget, smoothed against the current rate.
+
+    Each route (or any other key for a kind of request) is sampled at least
+    `min_per_route` times per window so that rarely used routes are never
+    starved. Those extra samples are limited to `rare_route_share` of the
+    window's event budget (or of its requests, without one), but never fewer
+    than `min_per_route`, so that many unique keys can't break the budget.
+    """
+
+    def __init__(self,
+                 target_events_per_second=0,
+                 max_overhead=0,
+                 min_per_route=DEFAULT_MIN_PER_ROUTE,
+                 window=DEFAULT_WINDOW,
+                 min_rate=DEFAULT_MIN_RATE,
+                 max_routes=DEFAULT_MAX_ROUTES,
+                 rare_route_share=DEFAULT_RARE_ROUTE_SHARE,
+                 smoothing=DEFAULT_SMOOTHING,
+                 clock=time.time,
+                 seed=None):
+
+        self.target_events_per_second = target_events_per_second
+        self.max_overhead = max_overhead
+        self.min_per_route = min_per_route
+        self.window = window
+        self.min_rate = min_rate
+        self.max_routes = max_routes
+        self.rare_route_share = rare_route_share
+        self.smoothing = smoothing
+        self.clock = clock
+        self.random = random.Random(seed)
+
+        self.lock = threading.Lock()
+        self.rate = 1.0
+        self.overhead_fraction = 0.0
+        self.reset_window(clock())
+
+    def reset_window(self, now):
+        self.window_started = now
+        self.seen = 0
+        self.sampled = 0
+        self.rare_sampled = 0
+        self.overhead = 0.0
+        self.route_counts = {}
+
+    def get_target_rate(self, elapsed):
+        """ The highest sample rate which keeps every budget. """
+
+        request_rate = self.seen / elapsed
+        if not request_rate:
+            return 1.0
+
+        target = 1.0
+
+        if self.target_events_per_second:
+            target = min(
+                target,
+                self.target_events_per_second / request_rate,
+            )
+
+        if self.max_overhead and self.sampled and self.overhead:
+            cost = self.overhead / self.sampled
+            affordable_per_second = self.max_overhead / cost
+            target = min(target, affordable_per_second / request_rate)
+
+        return target
+
+    def adjust(self, now):
+        elapsed = now - self.window_started
+
+        if elapsed < self.window:
+            return
+
+        self.overhead_fraction = self.overhead / elapsed
+
+        target = self.get_target_rate(elapsed)
+        rate = (
+            self.rate * (1 - self.smoothing) +
+            target * self.smoothing
+        )
+
+        self.rate = max(self.min_rate, min(1.0, rate))
+        self.reset_window(now)
+
+    def should_sample(self, route_name=None):
+        with self.lock:
+            self.adjust(self.clock())
+            self.seen += 1
+
+            sampled = self.random.random() < self.rate
+
+            if not sampled and route_name is not None:
+                sampled = self.is_rare_route(route_name)
+
+                if sampled:
+                    self.rare_sampled += 1
+
+            if sampled:
+                self.sampled += 1
+
+                if route_name is not None:
+                    count = self.route_counts.get(route_name)
+
+                    if count is not None:
+                        self.route_counts[route_name] = count + 1
+
+                    elif len(self.route_counts) < self.max_routes:
+                        self.route_counts[route_name] = 1
+
+            return sampled
+
+    def get_rare_route_budget(self):
+        """ The most samples rare routes may take in this window. """
+
+        if self.target_events_per_second:
+            budget = self.target_events_per_second * self.window
+        else:
+            budget = self.seen
+
+        return max(self.min_per_route, budget * self.rare_route_share)
+
+    def is_rare_route(self, route_name):
+        if self.rare_sampled >= self.get_rare_route_budget():
+            return False
+
+        count = self.route_counts.get(route_name)
+
+        if count is None:
+            return len(self.route_counts) < self.max_routes and bool(
+                self.min_per_route
+            )
+
+        return count < self.min_per_route
+
+    def record_overhead(self, seconds):
+        with self.lock:
+            self.overhead += seconds
+
+    def metrics(self):
+        return {
+            'sampling.rate': self.rate,
+            'sampling.overhead_fraction': self.overhead_fraction,
+            'sampling.seen': self.seen,
+            'sampling.sampled': self.sampled,
+            'sampling.rare_sampled': self.rare_sampled,
+        }
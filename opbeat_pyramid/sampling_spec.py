@@ -0,0 +1,178 @@
+import unittest
+
+from opbeat_pyramid import sampling
+
+
+class MockClock(object):
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class AdaptiveSamplerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = MockClock()
+
+    def make_sampler(self, **kwargs):
+        kwargs.setdefault('window', 10.0)
+        kwargs.setdefault('smoothing', 1.0)
+        kwargs.setdefault('min_per_route', 0)
+        kwargs.setdefault('seed', 1)
+
+        return sampling.AdaptiveSampler(clock=self.clock, **kwargs)
+
+    def run_window(self, sampler, requests, route_name=None):
+        sampled = sum(
+            1 for _ in range(requests) if sampler.should_sample(route_name)
+        )
+
+        self.clock.advance(sampler.window)
+        return sampled
+
+    def test_samples_everything_without_a_budget(self):
+        sampler = self.make_sampler()
+
+        self.assertEqual(self.run_window(sampler, 100), 100)
+        self.run_window(sampler, 100)
+
+        self.assertEqual(sampler.rate, 1.0)
+
+    def test_adjusts_rate_to_hold_an_events_per_second_budget(self):
+        sampler = self.make_sampler(target_events_per_second=10)
+
+        # 1000 requests over 10 seconds is 100 per second.
+        self.run_window(sampler, 1000)
+        sampled = self.run_window(sampler, 1000)
+
+        self.assertAlmostEqual(sampler.rate, 0.1)
+        self.assertAlmostEqual(sampled, 100, delta=30)
+
+    def test_adjusts_rate_to_hold_an_overhead_budget(self):
+        sampler = self.make_sampler(max_overhead=0.01)
+
+        # Each sampled request costs 10ms, so 1% of wall time affords one
+        # sampled request per second out of 10 per second.
+        for _ in range(100):
+            sampler.should_sample()
+            sampler.record_overhead(0.01)
+
+        self.clock.advance(10)
+        sampler.should_sample()
+
+        self.assertAlmostEqual(sampler.rate, 0.1)
+        self.assertAlmostEqual(sampler.metrics()['sampling.overhead_fraction'],
+                               0.1)
+
+    def test_rate_recovers_when_traffic_drops(self):
+        sampler = self.make_sampler(target_events_per_second=10)
+
+        self.run_window(sampler, 1000)
+        self.run_window(sampler, 1000)
+        self.assertLess(sampler.rate, 1.0)
+
+        self.run_window(sampler, 50)
+        self.run_window(sampler, 50)
+        self.assertEqual(sampler.rate, 1.0)
+
+    def test_rate_is_smoothed_between_windows(self):
+        sampler = self.make_sampler(
+            target_events_per_second=10,
+            smoothing=0.5,
+        )
+
+        self.run_window(sampler, 1000)
+        sampler.should_sample()
+
+        self.assertAlmostEqual(sampler.rate, 0.55)
+
+    def test_rate_never_falls_below_the_minimum(self):
+        sampler = self.make_sampler(
+            target_events_per_second=0.001,
+            min_rate=0.05,
+        )
+
+        self.run_window(sampler, 1000)
+        sampler.should_sample()
+
+        self.assertEqual(sampler.rate, 0.05)
+
+    def test_guarantees_a_minimum_per_route(self):
+        sampler = self.make_sampler(
+            target_events_per_second=0.001,
+            min_rate=0.0001,
+            min_per_route=2,
+        )
+
+        self.run_window(sampler, 1000, 'busy')
+
+        self.assertEqual(self.run_window(sampler, 5, 'rare'), 2)
+        self.assertEqual(self.run_window(sampler, 5, 'rare'), 2)
+
+    def test_route_guarantee_is_bounded(self):
+        sampler = self.make_sampler(
+            target_events_per_second=0.001,
+            min_rate=0.0001,
+            max_routes=2,
+            rare_route_share=1000,
+        )
+
+        sampler.min_per_route = 1
+        self.run_window(sampler, 1000)
+
+        sampled = [sampler.should_sample('route.%d' % i) for i in range(5)]
+        self.assertEqual(sampled, [True, True, False, False, False])
+
+    def test_rare_routes_only_take_a_share_of_the_budget(self):
+        sampler = self.make_sampler(
+            target_events_per_second=1,
+            min_per_route=1,
+        )
+
+        sampler.rate = 0.001
+
+        # Every slug is a new key, but only half of the window's 10 events
+        # may be spent on them.
+        sampled = sum(
+            1 for index in range(2000)
+            if sampler.should_sample('/articles/slug-%d' % index)
+        )
+
+        self.assertEqual(sampler.rare_sampled, 5)
+        self.assertLessEqual(sampled, 10)
+
+        self.clock.advance(sampler.window)
+        sampler.should_sample('/articles/another-slug')
+        self.assertEqual(sampler.rare_sampled, 1)
+
+    def test_is_deterministic_for_a_seed(self):
+        first = self.make_sampler(target_events_per_second=10)
+        first_results = [self.run_window(first, 500) for _ in range(3)]
+
+        self.clock = MockClock()
+        second = self.make_sampler(target_events_per_second=10)
+        second_results = [self.run_window(second, 500) for _ in range(3)]
+
+        self.assertEqual(first_results, second_results)
+
+    def test_metrics_expose_the_current_rate(self):
+        sampler = self.make_sampler()
+        sampler.should_sample()
+
+        metrics = sampler.metrics()
+        self.assertEqual(metrics['sampling.rate'], 1.0)
+        self.assertEqual(metrics['sampling.seen'], 1)
+        self.assertEqual(metrics['sampling.sampled'], 1)
+
+    def test_get_path_key_groups_paths_by_their_ids(self):
+        self.assertEqual(sampling.get_path_key('/users/1'), '/users/*')
+        self.assertEqual(
+            sampling.get_path_key('/users/42/posts/ab12cd'),
+            '/users/*/posts/*',
+        )
+        self.assertEqual(sampling.get_path_key('/about/'), '/about/')
+        self.assertEqual(sampling.get_path_key('/'), '/')
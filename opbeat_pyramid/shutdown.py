@@ -0,0 +1,240 @@
+import atexit
+import logging
+import os
+import signal
+import threading
+import time
+
+
+DEFAULT_SHUTDOWN_TIMEOUT = 5.0
+
+
+logger = logging.getLogger(__name__)
+
+
+def count_stored_transactions(client):
+    try:
+        return len(client.instrumentation_store)
+
+    except Exception:
+        return 0
+
+
+def get_transport_queues(client):
+    """ Queues of messages waiting for a client's async transports. """
+
+    queues = []
+
+    for transport in list(getattr(client, '_transports', {}).values()):
+        worker = getattr(transport, '_worker', None)
+        queue = getattr(worker, '_queue', None)
+
+        if queue is not None:
+            queues.append(queue)
+
+    return queues
+
+
+def count_queued_messages(client):
+    return sum(
+        queue.unfinished_tasks for queue in get_transport_queues(client)
+    )
+
+
+def wait_for_queue(queue, deadline):
+    with queue.all_tasks_done:
+        while queue.unfinished_tasks:
+            remaining = deadline - time.time()
+
+            if remaining <= 0:
+                return False
+
+            queue.all_tasks_done.wait(remaining)
+
+    return True
+
+
+def flush_client(client, deadline, results):
+    try:
+        client._traces_collect()
+
+    except Exception:
+        logger.exception('Failed to flush opbeat client.')
+        return
+
+    results.append(client)
+
+    for queue in get_transport_queues(client):
+        wait_for_queue(queue, deadline)
+
+
+def count_flushed(stored, queued, remaining, collected):
+    """ Split pending events into (flushed, dropped) counts.
+
+    Stored transactions are sent as a single message, queued after any
+    messages which were already waiting. Messages are sent in order, so the
+    transactions are the first to be dropped when messages remain.
+    """
+
+    if not collected:
+        dropped = stored + min(remaining, queued)
+
+    elif remaining and stored:
+        dropped = stored + remaining - 1
+
+    else:
+        dropped = remaining
+
+    dropped = min(dropped, stored + queued)
+    return stored + queued - dropped, dropped
+
+
+def flush_clients(clients, timeout=DEFAULT_SHUTDOWN_TIMEOUT):
+    """ Flush clients in parallel, giving up on any left after `timeout`.
+
+    Returns a tuple of (flushed, dropped) event counts. Events are flushed
+    once their transport has finished sending them.
+    """
+
+    deadline = time.time() + timeout
+
+    pending = [
+        (client, count_stored_transactions(client),
+         count_queued_messages(client))
+        for client in clients
+    ]
+
+    collected_clients = []
+    workers = []
+
+    for client, _, _ in pending:
+        worker = threading.Thread(
+            target=flush_client,
+            args=(client, deadline, collected_clients),
+            name='opbeat-flush',
+        )
+
+        # Workers still blocked at the deadline mustn't hold up process exit.
+        worker.daemon = True
+        worker.start()
+        workers.append(worker)
+
+    for worker in workers:
+        worker.join(max(0.0, deadline - time.time()))
+
+    flushed = 0
+    dropped = 0
+
+    for client, stored, queued in pending:
+        collected = any(client is other for other in list(collected_clients))
+
+        client_flushed, client_dropped = count_flushed(
+            stored,
+            queued,
+            count_queued_messages(client),
+            collected,
+        )
+
+        flushed += client_flushed
+        dropped += client_dropped
+
+    return flushed, dropped
+
+
+class ShutdownFlusher(object):
+    """ Flushes the opbeat clients cached on a registry when a worker exits.
+
+    Signals flush before they are handled, and may be handled gracefully by
+    the server while requests are still finishing. So only the flush at exit
+    is final: later calls do nothing. Every flush shares one deadline, set
+    `timeout` seconds after the first one starts.
+    """
+
+    def __init__(self, registry, timeout=DEFAULT_SHUTDOWN_TIMEOUT):
+        self.registry = registry
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.done = False
+        self.deadline = None
+        self.previous_handlers = {}
+
+    def __call__(self):
+        with self.lock:
+            if self.done:
+                return None
+
+            self.done = True
+
+        return self.flush()
+
+    def get_deadline(self):
+        with self.lock:
+            if self.deadline is None:
+                self.deadline = time.time() + self.timeout
+
+            return self.deadline
+
+    def flush(self):
+        deadline = self.get_deadline()
+
+        # Exceptions captured in the background still need to be sent.
+        worker = getattr(self.registry, '_opbeat_capture_worker', None)
+        if worker is not None:
+            worker.drain(max(0.0, deadline - time.time()))
+
+        clients = list(getattr(self.registry, '_opbeat_clients', {}).values())
+        flushed, dropped = flush_clients(
+            clients,
+            max(0.0, deadline - time.time()),
+        )
+
+        if worker is not None:
+            dropped += worker.pending()
+
+        logger.info(
+            'Flushed %d opbeat events on shutdown, dropped %d.',
+            flushed,
+            dropped,
+        )
+
+        return flushed, dropped
+
+    def handle_signal(self, signum, frame):
+        self.flush()
+
+        previous = self.previous_handlers.get(signum)
+
+        if callable(previous):
+            return previous(signum, frame)
+
+        if previous != signal.SIG_IGN:
+            signal.signal(signum, signal.SIG_DFL)
+            os.kill(os.getpid(), signum)
+
+    def install(self, signal_names=()):
+        atexit.register(self)
+
+        for signal_name in signal_names:
+            signum = getattr(signal, signal_name.strip().upper())
+
+            try:
+                previous = signal.signal(signum, self.handle_signal)
+
+            except ValueError:
+                # Signal handlers can only be installed from the main thread.
+                logger.warning(
+                    'Unable to install opbeat flush handler for %s.',
+                    signal_name,
+                )
+                continue
+
+            self.previous_handlers[signum] = previous
+
+
+def unregister_client_atexit(client):
+    """ Stop a client from flushing itself at exit without any deadline. """
+
+    unregister = getattr(atexit, 'unregister', None)
+
+    if unregister is not None:
+        unregister(client.close)
@@ -0,0 +1,189 @@
+import mock
+import signal
+import threading
+import time
+import unittest
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from opbeat_pyramid import shutdown
+
+
+def mock_client(pending, queued=0):
+    client = mock.MagicMock()
+    client.instrumentation_store.__len__.return_value = pending
+    client._transports = {}
+
+    if queued:
+        transport = mock.MagicMock()
+        transport._worker._queue = queue.Queue()
+        client._transports['mock url'] = transport
+
+        for _ in range(queued):
+            transport._worker._queue.put(None)
+
+    return client
+
+
+def drain(client):
+    for transport in client._transports.values():
+        transport_queue = transport._worker._queue
+
+        while transport_queue.unfinished_tasks:
+            transport_queue.get()
+            transport_queue.task_done()
+
+
+class OpbeatShutdownTestCase(unittest.TestCase):
+    def test_flush_clients_collects_every_client(self):
+        clients = [mock_client(2), mock_client(3)]
+
+        self.assertEqual(shutdown.flush_clients(clients, timeout=1), (5, 0))
+
+        for client in clients:
+            client._traces_collect.assert_called_once_with()
+
+    def test_flush_clients_drops_clients_which_miss_the_deadline(self):
+        release = threading.Event()
+
+        slow_client = mock_client(4)
+        slow_client._traces_collect.side_effect = lambda: release.wait(5)
+
+        try:
+            result = shutdown.flush_clients(
+                [mock_client(1), slow_client],
+                timeout=0.05,
+            )
+        finally:
+            release.set()
+
+        self.assertEqual(result, (1, 4))
+
+    def test_flush_clients_drops_clients_which_fail_to_collect(self):
+        broken_client = mock_client(3)
+        broken_client._traces_collect.side_effect = ValueError()
+
+        self.assertEqual(
+            shutdown.flush_clients([broken_client], timeout=1),
+            (0, 3),
+        )
+
+    def test_flush_clients_waits_for_queued_messages_to_be_sent(self):
+        client = mock_client(0, queued=2)
+        client._traces_collect.side_effect = lambda: drain(client)
+
+        self.assertEqual(shutdown.flush_clients([client], timeout=1), (2, 0))
+
+    def test_flush_clients_drops_messages_still_queued_at_the_deadline(self):
+        client = mock_client(3, queued=2)
+
+        # The stored transactions are queued after the existing messages.
+        client._traces_collect.side_effect = (
+            lambda: client._transports['mock url']._worker._queue.put(None)
+        )
+
+        self.assertEqual(
+            shutdown.flush_clients([client], timeout=0.05),
+            (0, 5),
+        )
+
+    def test_count_flushed_drops_transactions_queued_last_first(self):
+        self.assertEqual(shutdown.count_flushed(3, 2, 0, True), (5, 0))
+        self.assertEqual(shutdown.count_flushed(3, 2, 1, True), (2, 3))
+        self.assertEqual(shutdown.count_flushed(3, 2, 2, True), (1, 4))
+        self.assertEqual(shutdown.count_flushed(0, 2, 1, True), (1, 1))
+        self.assertEqual(shutdown.count_flushed(3, 2, 2, False), (0, 5))
+
+    def test_shutdown_flusher_only_flushes_once_at_exit(self):
+        registry = mock.MagicMock()
+        registry._opbeat_clients = {'mock app id': mock_client(2)}
+        registry._opbeat_capture_worker = None
+
+        flusher = shutdown.ShutdownFlusher(registry, timeout=1)
+
+        self.assertEqual(flusher(), (2, 0))
+        self.assertIsNone(flusher())
+
+        client = registry._opbeat_clients['mock app id']
+        client._traces_collect.assert_called_once_with()
+
+    def test_shutdown_flusher_drains_background_captures_first(self):
+        registry = mock.MagicMock()
+        registry._opbeat_clients = {'mock app id': mock_client(2)}
+        registry._opbeat_capture_worker.pending.return_value = 1
+
+        flusher = shutdown.ShutdownFlusher(registry, timeout=1)
+
+        self.assertEqual(flusher(), (2, 1))
+
+        timeout = registry._opbeat_capture_worker.drain.call_args[0][0]
+        self.assertTrue(0 < timeout <= 1)
+
+    @mock.patch('atexit.register')
+    @mock.patch('signal.signal')
+    def test_install_registers_atexit_and_signal_hooks(self, sig, register):
+        previous_handler = mock.MagicMock()
+        sig.return_value = previous_handler
+
+        flusher = shutdown.ShutdownFlusher(mock.MagicMock())
+        flusher.install(['sigterm'])
+
+        register.assert_called_once_with(flusher)
+        sig.assert_called_once_with(signal.SIGTERM, flusher.handle_signal)
+        self.assertIs(flusher.previous_handlers[signal.SIGTERM],
+                      previous_handler)
+
+    def test_handle_signal_flushes_and_chains_previous_handler(self):
+        previous_handler = mock.MagicMock()
+
+        flusher = shutdown.ShutdownFlusher(mock.MagicMock())
+        flusher.previous_handlers[signal.SIGTERM] = previous_handler
+
+        with mock.patch.object(flusher, 'flush') as flush:
+            flusher.handle_signal(signal.SIGTERM, None)
+
+        flush.assert_called_once_with()
+        previous_handler.assert_called_once_with(signal.SIGTERM, None)
+
+    def test_requests_finishing_after_a_signal_are_flushed_at_exit(self):
+        client = mock_client(1)
+
+        registry = mock.MagicMock()
+        registry._opbeat_clients = {'mock app id': client}
+        registry._opbeat_capture_worker = None
+
+        flusher = shutdown.ShutdownFlusher(registry, timeout=1)
+        flusher.previous_handlers[signal.SIGTERM] = mock.MagicMock()
+
+        flusher.handle_signal(signal.SIGTERM, None)
+        self.assertFalse(flusher.done)
+
+        client.instrumentation_store.__len__.return_value = 2
+        self.assertEqual(flusher(), (2, 0))
+        self.assertEqual(client._traces_collect.call_count, 2)
+
+    def test_flushes_after_a_signal_share_one_deadline(self):
+        # The queued message is never sent, so each flush waits it out.
+        registry = mock.MagicMock()
+        registry._opbeat_clients = {'mock app id': mock_client(0, queued=1)}
+        registry._opbeat_capture_worker = None
+
+        flusher = shutdown.ShutdownFlusher(registry, timeout=0.2)
+        flusher.previous_handlers[signal.SIGTERM] = mock.MagicMock()
+
+        started = time.time()
+        flusher.handle_signal(signal.SIGTERM, None)
+
+        self.assertEqual(flusher(), (0, 1))
+        self.assertLess(time.time() - started, 0.3)
+
+    def test_unregister_client_atexit_unregisters_client_close(self):
+        client = mock.MagicMock()
+
+        with mock.patch('atexit.unregister') as unregister:
+            shutdown.unregister_client_atexit(client)
+
+        unregister.assert_called_once_with(client.close)
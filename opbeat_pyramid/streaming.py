@@ -0,0 +1,89 @@
+import time
+
+from webob.response import AppIterRange
+
+
+class TimedAppIter(object):
+    """ Measures how long a response body takes to send, and its size.
+
+    Chunks are passed through untouched. `on_close` is called with this
+    object once the WSGI server closes the iterable.
+    """
+
+    def __init__(self, app_iter, started, on_close):
+        self.app_iter = app_iter
+        self.started = started
+        self.on_close = on_close
+
+        self.first_byte_at = None
+        self.finished_at = None
+        self.bytes_sent = 0
+
+    def __iter__(self):
+        for chunk in self.app_iter:
+            if self.first_byte_at is None:
+                self.first_byte_at = time.time()
+
+            self.bytes_sent += len(chunk)
+            yield chunk
+
+    def app_iter_range(self, start, stop):
+        """ Serve a byte range, still timing it and reporting on close.
+
+        WebOb would otherwise wrap this object in an iterable which never
+        closes it.
+        """
+
+        app_iter_range = getattr(self.app_iter, 'app_iter_range', None)
+
+        if app_iter_range is not None:
+            app_iter = app_iter_range(start, stop)
+        else:
+            app_iter = AppIterRange(self.app_iter, start, stop)
+
+        if app_iter is None:
+            return None
+
+        self.app_iter = app_iter
+        return self
+
+    def close(self):
+        try:
+            close = getattr(self.app_iter, 'close', None)
+
+            if close is not None:
+                close()
+
+        finally:
+            self.finished_at = time.time()
+            self.on_close(self)
+
+    def time_to_first_byte(self):
+        if self.first_byte_at is None:
+            return None
+
+        return (self.first_byte_at - self.started) * 1000
+
+    def body_duration(self):
+        if self.first_byte_at is None or self.finished_at is None:
+            return None
+
+        return (self.finished_at - self.first_byte_at) * 1000
+
+    def as_dict(self):
+        return {
+            'response.bytes': self.bytes_sent,
+            'response.time_to_first_byte': self.time_to_first_byte(),
+            'response.body_duration': self.body_duration(),
+        }
+
+
+def is_file_wrapper(app_iter, environ):
+    """ Whether the server could send this body without reading it at all. """
+
+    file_wrapper = environ.get('wsgi.file_wrapper')
+
+    if not isinstance(file_wrapper, type):
+        return False
+
+    return isinstance(app_iter, file_wrapper)
@@ -0,0 +1,96 @@
+import mock
+import unittest
+
+from opbeat_pyramid import streaming
+
+
+class FileWrapper(object):
+    def __init__(self, filelike, block_size=8192):
+        self.filelike = filelike
+
+
+class OpbeatStreamingTestCase(unittest.TestCase):
+    @mock.patch('time.time')
+    def test_timed_app_iter_measures_the_response_body(self, time):
+        time.side_effect = [1.5, 4.0]
+        on_close = mock.MagicMock()
+
+        timer = streaming.TimedAppIter([b'abc', b'de'], 1.0, on_close)
+
+        self.assertEqual(list(timer), [b'abc', b'de'])
+        on_close.assert_not_called()
+
+        timer.close()
+        on_close.assert_called_once_with(timer)
+
+        self.assertEqual(timer.as_dict(), {
+            'response.bytes': 5,
+            'response.time_to_first_byte': 500.0,
+            'response.body_duration': 2500.0,
+        })
+
+    def test_timed_app_iter_passes_chunks_through_without_copying(self):
+        chunk = bytearray(b'x' * 1024)
+        timer = streaming.TimedAppIter([chunk], 0, mock.MagicMock())
+
+        self.assertIs(next(iter(timer)), chunk)
+
+    def test_timed_app_iter_closes_the_wrapped_app_iter(self):
+        app_iter = mock.MagicMock()
+        app_iter.__iter__.return_value = iter([])
+        on_close = mock.MagicMock()
+
+        timer = streaming.TimedAppIter(app_iter, 0, on_close)
+        list(timer)
+        timer.close()
+
+        app_iter.close.assert_called_once_with()
+        on_close.assert_called_once_with(timer)
+
+    def test_timed_app_iter_reports_even_if_closing_fails(self):
+        app_iter = mock.MagicMock()
+        app_iter.close.side_effect = IOError()
+        on_close = mock.MagicMock()
+
+        timer = streaming.TimedAppIter(app_iter, 0, on_close)
+
+        self.assertRaises(IOError, timer.close)
+        on_close.assert_called_once_with(timer)
+
+    def test_timed_app_iter_without_a_body(self):
+        timer = streaming.TimedAppIter([], 0, mock.MagicMock())
+        list(timer)
+        timer.close()
+
+        self.assertEqual(timer.as_dict(), {
+            'response.bytes': 0,
+            'response.time_to_first_byte': None,
+            'response.body_duration': None,
+        })
+
+    def test_timed_app_iter_serves_ranges_of_plain_iterables(self):
+        on_close = mock.MagicMock()
+        timer = streaming.TimedAppIter([b'abc', b'def'], 0, on_close)
+
+        self.assertIs(timer.app_iter_range(2, 4), timer)
+        self.assertEqual(b''.join(timer), b'cd')
+
+        timer.close()
+        on_close.assert_called_once_with(timer)
+
+    def test_timed_app_iter_passes_ranges_to_the_wrapped_app_iter(self):
+        app_iter = mock.MagicMock()
+        app_iter.app_iter_range.return_value = [b'cd']
+
+        timer = streaming.TimedAppIter(app_iter, 0, mock.MagicMock())
+
+        self.assertIs(timer.app_iter_range(2, 4), timer)
+        app_iter.app_iter_range.assert_called_once_with(2, 4)
+        self.assertEqual(list(timer), [b'cd'])
+
+    def test_is_file_wrapper_detects_server_file_wrappers(self):
+        environ = {'wsgi.file_wrapper': FileWrapper}
+
+        self.assertTrue(streaming.is_file_wrapper(FileWrapper(None), environ))
+        self.assertFalse(streaming.is_file_wrapper([b''], environ))
+        self.assertFalse(streaming.is_file_wrapper([b''], {}))
@@ -3,16 +3,28 @@ import functools
 import opbeat
 import os
 import sys
+import threading
+import time
 
 
 import pyramid.tweens
 
+from opbeat import traces
 from opbeat.instrumentation import control
 
 from pyramid import events
 from pyramid import httpexceptions
 from pyramid import settings
 
+from opbeat_pyramid import buffering
+from opbeat_pyramid import capture
+from opbeat_pyramid import propagation
+from opbeat_pyramid import resources
+from opbeat_pyramid import rollups
+from opbeat_pyramid import rules
+from opbeat_pyramid import sampling
+from opbeat_pyramid import shutdown
+from opbeat_pyramid import streaming
 from opbeat_pyramid import tweens
 
 
@@ -20,6 +32,8 @@ control.instrument()
 
 
 DEFAULT_UNKNOWN_ROUTE_TEXT = 'Unknown Route'
+DETAILS_TRACE_KIND = 'transaction.details'
+DETAILS_TRACE_SIGNATURE = 'Details'
 NO_DEFAULT_PROVIDED = {}
 OPBEAT_SETTING_PREFIX = 'opbeat.'
 TRUTHY_VALUES = {True, 'true', 'yes', 'on'}
@@ -33,8 +47,15 @@ DEFAULT_UNSAFE_SETTINGS_PHRASES = (
 
 logger = logging.getLogger(__name__)
 
+# The request on each thread whose response body hasn't been closed yet.
+pending_response = threading.local()
+
 
 def get_opbeat_setting(request, name, default=NO_DEFAULT_PROVIDED):
+    return get_registry_setting(request.registry, name, default)
+
+
+def get_registry_setting(registry, name, default=NO_DEFAULT_PROVIDED):
     setting_name = OPBEAT_SETTING_PREFIX + name
 
     env_setting_name = setting_name.replace('.', '_').upper()
@@ -43,7 +64,7 @@ def get_opbeat_setting(request, name, default=NO_DEFAULT_PROVIDED):
     if environment_override:
         return environment_override
 
-    result = request.registry.settings.get(setting_name, default)
+    result = registry.settings.get(setting_name, default)
 
     if result is NO_DEFAULT_PROVIDED:
         raise ValueError('Setting ' + setting_name + ' is required.')
@@ -61,11 +82,14 @@ def get_opbeat_client_cache(request):
 def create_opbeat_client(request, app_id):
     secret_token = get_opbeat_setting(request, 'secret_token')
     organization_id = get_opbeat_setting(request, 'organization_id')
+    servers = get_opbeat_setting(request, 'servers', default='')
 
     return opbeat.Client(
         secret_token=secret_token,
         organization_id=organization_id,
         app_id=app_id,
+        servers=[server for server in servers.split(',') if server] or None,
+        string_max_length=get_max_string_length(request) or None,
     )
 
 
@@ -80,9 +104,158 @@ def opbeat_client_factory(request):
 
     clients[app_id] = create_opbeat_client(request, app_id)
 
+    # Shutdown hooks flush this client with a deadline instead.
+    if getattr(request.registry, '_opbeat_shutdown_flusher', None):
+        shutdown.unregister_client_atexit(clients[app_id])
+
     return clients[app_id]
 
 
+def get_shutdown_timeout(registry):
+    return float(get_registry_setting(
+        registry,
+        'shutdown_timeout',
+        default=shutdown.DEFAULT_SHUTDOWN_TIMEOUT,
+    ))
+
+
+def flush_opbeat_clients(registry, timeout=None):
+    """ Flush every cached client. Returns (flushed, dropped) counts. """
+
+    if timeout is None:
+        timeout = get_shutdown_timeout(registry)
+
+    clients = getattr(registry, '_opbeat_clients', {})
+    return shutdown.flush_clients(list(clients.values()), timeout)
+
+
+def install_shutdown_hooks(registry):
+    if getattr(registry, '_opbeat_shutdown_flusher', None):
+        return registry._opbeat_shutdown_flusher
+
+    signal_names = get_registry_setting(
+        registry,
+        'shutdown_signals',
+        default='',
+    )
+
+    flusher = shutdown.ShutdownFlusher(
+        registry,
+        timeout=get_shutdown_timeout(registry),
+    )
+
+    flusher.install([
+        name.strip() for name in signal_names.split(',') if name.strip()
+    ])
+    registry._opbeat_shutdown_flusher = flusher
+
+    return flusher
+
+
+def get_transaction_buffer(request):
+    if not hasattr(request.registry, '_opbeat_transaction_buffers'):
+        request.registry._opbeat_transaction_buffers = {}
+
+    buffers = request.registry._opbeat_transaction_buffers
+    app_id = get_opbeat_setting(request, 'app_id')
+
+    if app_id not in buffers:
+        buffers[app_id] = create_transaction_buffer(request)
+
+    return buffers[app_id]
+
+
+def create_transaction_buffer(request):
+    return buffering.TransactionBuffer(
+        max_groups=int(get_opbeat_setting(
+            request,
+            'transaction_buffer.max_groups',
+            default=buffering.DEFAULT_MAX_GROUPS,
+        )),
+        max_pending=int(get_opbeat_setting(
+            request,
+            'transaction_buffer.max_pending',
+            default=buffering.DEFAULT_MAX_PENDING,
+        )),
+        high_water_ratio=float(get_opbeat_setting(
+            request,
+            'transaction_buffer.high_water_ratio',
+            default=buffering.DEFAULT_HIGH_WATER_RATIO,
+        )),
+        overflow_route_name=get_opbeat_setting(
+            request,
+            'transaction_buffer.overflow_route_name',
+            default=buffering.DEFAULT_OVERFLOW_ROUTE_NAME,
+        ),
+    )
+
+
+def flush_transactions(client, transaction_buffer):
+    # Transactions ending during the flush are counted towards the next one.
+    transaction_buffer.clear(flushed=True)
+
+    try:
+        client._traces_collect()
+
+    except Exception:
+        logger.exception('Failed to flush buffered transactions to opbeat.')
+
+
+def get_background_flusher(request, client, transaction_buffer):
+    if not hasattr(request.registry, '_opbeat_background_flushers'):
+        request.registry._opbeat_background_flushers = {}
+
+    flushers = request.registry._opbeat_background_flushers
+    app_id = get_opbeat_setting(request, 'app_id')
+
+    if app_id not in flushers:
+        flushers[app_id] = buffering.BackgroundFlusher(functools.partial(
+            flush_transactions,
+            client,
+            transaction_buffer,
+        ))
+
+    return flushers[app_id]
+
+
+def drop_transaction_traces():
+    """ Make the current transaction record nothing but its duration. """
+
+    transaction = traces.get_transaction()
+
+    if transaction is None:
+        return
+
+    transaction.transaction_traces = []
+
+    # Ending a placeholder instead of the root trace records no trace at all.
+    transaction.trace_stack = [None]
+
+
+def get_opbeat_metrics(request):
+    """ Get metrics describing this module's own resource usage. """
+
+    client = get_opbeat_client_cache(request).get(
+        get_opbeat_setting(request, 'app_id'),
+    )
+
+    store = client.instrumentation_store if client else None
+
+    metrics = {}
+    metrics.update(get_transaction_buffer(request).metrics(store))
+
+    sampler = get_sampler(request)
+    if sampler is not None:
+        metrics.update(sampler.metrics())
+
+    worker = getattr(request.registry, '_opbeat_capture_worker', None)
+    if worker is not None:
+        metrics['capture.pending'] = worker.pending()
+        metrics['capture.dropped'] = worker.dropped
+
+    return metrics
+
+
 def setting_is_enabled(request, setting_name):
     return settings.asbool(get_opbeat_setting(request, setting_name, False))
 
@@ -127,17 +300,167 @@ def get_safe_settings(request):
     return result
 
 
-def should_ignore_exception(request, exc):
-    if not is_http_exception(exc):
-        return False
+def compile_rule_setting(registry, name, allowed_keys=rules.RULE_KEYS):
+    lines = settings.aslist(
+        get_registry_setting(registry, name, default=''),
+        flatten=False,
+    )
 
-    return settings.asbool(get_opbeat_setting(
+    return rules.compile_rules(lines, allowed_keys)
+
+
+def compile_ignore_rules(registry):
+    """ Compile the ignore rules in the settings into fast matchers. """
+
+    registry._opbeat_ignore_rules = compile_rule_setting(
+        registry,
+        'ignore',
+    )
+
+    registry._opbeat_skip_rules = compile_rule_setting(
+        registry,
+        'skip_transactions',
+        rules.SKIP_RULE_KEYS,
+    )
+
+
+def get_ignore_rules(request):
+    if getattr(request.registry, '_opbeat_ignore_rules', None) is None:
+        compile_ignore_rules(request.registry)
+
+    return request.registry._opbeat_ignore_rules
+
+
+def get_skip_rules(request):
+    if getattr(request.registry, '_opbeat_skip_rules', None) is None:
+        compile_ignore_rules(request.registry)
+
+    return request.registry._opbeat_skip_rules
+
+
+def get_matched_route_name(request):
+    matched_route = getattr(request, 'matched_route', None)
+    return matched_route.name if matched_route else None
+
+
+def should_ignore_exception(request, exc):
+    if is_http_exception(exc) and settings.asbool(get_opbeat_setting(
         request,
         'ignore_http_exceptions',
         default=False,
+    )):
+        return True
+
+    ignore_rules = get_ignore_rules(request)
+
+    if not ignore_rules:
+        return False
+
+    exc_value = exc[1] if exc else None
+
+    if isinstance(exc_value, httpexceptions.HTTPException):
+        status = exc_value.code
+    else:
+        status = rules.DEFAULT_ERROR_STATUS
+
+    return ignore_rules.match(
+        path=request.path,
+        route_name=get_matched_route_name(request),
+        status=status,
+        exc_type=type(exc_value) if exc_value is not None else None,
+        user_agent=request.user_agent,
+    ) is not None
+
+
+def should_skip_transaction(request):
+    skip_rules = get_skip_rules(request)
+
+    if not skip_rules:
+        return False
+
+    return skip_rules.match(
+        path=request.path,
+        user_agent=request.user_agent,
+    ) is not None
+
+
+def get_max_string_length(request):
+    return int(get_opbeat_setting(
+        request,
+        'capture.max_string_length',
+        default=0,
     ))
 
 
+def get_locals_mode(request):
+    locals_mode = get_opbeat_setting(
+        request,
+        'capture.locals',
+        default=capture.LOCALS_FULL,
+    )
+
+    if locals_mode not in capture.LOCALS_MODES:
+        raise ValueError(
+            'Setting ' + OPBEAT_SETTING_PREFIX + 'capture.locals must be one '
+            'of: ' + ', '.join(capture.LOCALS_MODES)
+        )
+
+    return locals_mode
+
+
+def snapshot_exception(request, exc_info, max_payload_bytes=0,
+                       in_background=False):
+    allowlist = get_opbeat_setting(
+        request,
+        'capture.locals_allowlist',
+        default='',
+    )
+
+    return capture.snapshot_exc_info(
+        exc_info,
+        max_frames=int(get_opbeat_setting(
+            request,
+            'capture.max_frames',
+            default=0,
+        )),
+        locals_mode=get_locals_mode(request),
+        allowlist=[name.strip() for name in allowlist.split(',')],
+        max_string_length=(
+            get_max_string_length(request) or
+            capture.DEFAULT_MAX_STRING_LENGTH
+        ),
+        max_payload_bytes=max_payload_bytes,
+        in_background=in_background,
+    )
+
+
+def get_capture_worker(request):
+    registry = request.registry
+
+    if not getattr(registry, '_opbeat_capture_worker', None):
+        registry._opbeat_capture_worker = capture.CaptureWorker(int(
+            get_opbeat_setting(
+                request,
+                'capture.queue_size',
+                default=capture.DEFAULT_QUEUE_SIZE,
+            )
+        ))
+
+    return registry._opbeat_capture_worker
+
+
+def send_exception(client, exc_info, data, extra, max_payload_bytes):
+    extra = capture.fit_payload(exc_info, extra, max_payload_bytes)
+
+    try:
+        return client.capture_exception(exc_info, data=data, extra=extra)
+
+    except Exception:
+        # NOTE: This should not be allowed until we know which exception we are
+        # looking for here.
+        pass
+
+
 def capture_exception(request, exc_info, extra):
     client = opbeat_client_factory(request)
 
@@ -149,13 +472,34 @@ def capture_exception(request, exc_info, extra):
         }
     }
 
-    try:
-        return client.capture_exception(exc_info, data=data, extra=extra)
+    max_string_length = get_max_string_length(request)
+    if max_string_length:
+        extra = capture.limit_extra(extra, max_string_length)
 
-    except Exception:
-        # NOTE: This should not be allowed until we know which exception we are
-        # looking for here.
-        pass
+    max_payload_bytes = int(get_opbeat_setting(
+        request,
+        'capture.max_payload_bytes',
+        default=0,
+    ))
+
+    in_background = setting_is_enabled(request, 'capture.in_background')
+
+    exc_info = snapshot_exception(
+        request,
+        exc_info,
+        max_payload_bytes,
+        in_background,
+    )
+
+    args = (client, exc_info, data, extra, max_payload_bytes)
+
+    if in_background:
+        if not get_capture_worker(request).submit(send_exception, *args):
+            logger.warning('Dropped exception: opbeat capture queue is full.')
+
+        return None
+
+    return send_exception(*args)
 
 
 def get_full_request_url(request):
@@ -194,7 +538,67 @@ def get_exception_for_request(request):
     return sys_exc
 
 
+def should_time_response_body(request, response):
+    if not getattr(request, '_opbeat_client', None):
+        return False
+
+    if getattr(response, 'app_iter', None) is None:
+        return False
+
+    # Wrapping would stop the server from sending files without copying.
+    if streaming.is_file_wrapper(response.app_iter, request.environ):
+        return False
+
+    return setting_is_enabled(request, 'time_response_body')
+
+
+def time_response_body(request, response, started):
+    """ Defer the end of the transaction until the body has been sent. """
+
+    request._opbeat_response_timer = streaming.TimedAppIter(
+        response.app_iter,
+        started,
+        functools.partial(on_response_body_sent, request),
+    )
+
+    # WebOb drops the Content-Length when the app_iter is replaced, which
+    # would also stop it from answering range requests.
+    content_length = response.content_length
+    response.app_iter = request._opbeat_response_timer
+    response.content_length = content_length
+    pending_response.request = request
+
+
+def end_abandoned_transaction():
+    """ End the transaction of a response body that was never closed.
+
+    Servers must close response bodies, but a transaction left open by one
+    which doesn't would otherwise collect the traces of whatever runs next on
+    its thread. It ends when the thread's next request begins instead.
+    """
+
+    request = getattr(pending_response, 'request', None)
+
+    if request is None:
+        return
+
+    pending_response.request = None
+
+    annotate_transaction(dict(
+        request._opbeat_response_timer.as_dict(),
+        **{'response.closed': False}
+    ))
+
+    end_transaction(
+        request,
+        get_route_name(request),
+        get_status_code(request),
+    )
+
+
 def opbeat_tween(handler, registry, request):
+    started = time.time()
+
     try:
         response = handler(request)
     except Exception:
@@ -205,6 +609,9 @@ def opbeat_tween(handler, registry, request):
     if exc_info is not None:
         handle_exception(request, exc_info)
 
+    if should_time_response_body(request, response):
+        time_response_body(request, response, started)
+
     return response
 
 
@@ -248,23 +655,408 @@ def get_route_name(request):
     )
 
 
+def get_details_trace(transaction):
+    """ Get the trace which holds a transaction's own details. """
+
+    details = getattr(transaction, '_opbeat_details_trace', None)
+
+    if details is not None:
+        return details
+
+    if not transaction.trace_stack or transaction.trace_stack[0] is None:
+        return None
+
+    # The root trace of a transaction stays on the stack until it ends.
+    root_trace = transaction.trace_stack[0]
+
+    started = time.time()
+    details = traces.Trace(
+        DETAILS_TRACE_SIGNATURE,
+        DETAILS_TRACE_KIND,
+        started,
+        extra={},
+    )
+
+    details.parents = (root_trace.signature,)
+    details.trace_duration = 0.0
+    details.rel_start_time = (started - root_trace.abs_start_time) * 1000
+
+    transaction.transaction_traces.append(details)
+    transaction._opbeat_details_trace = details
+
+    return details
+
+
+def add_details_to_totals(client, details):
+    """ Fold an ended transaction's details into the totals for its route.
+
+    opbeat groups the details traces of a route together, keeping the extra
+    data of only the first one, so that data is replaced with the totals of
+    every transaction in the group. Groups which have already been collected
+    are left alone.
+    """
+
+    store = client.instrumentation_store
+
+    with store.cond:
+        group = store._traces.get(details.fingerprint)
+
+        if group is None:
+            return
+
+        if group.extra is details.extra:
+            group.extra = rollups.merge_details({}, details.extra)
+        else:
+            group.extra = rollups.merge_details(group.extra, details.extra)
+
+
+def annotate_transaction(data):
+    """ Merge data into the extra details of the current transaction. """
+
+    transaction = traces.get_transaction()
+
+    if transaction is None:
+        return False
+
+    details = get_details_trace(transaction)
+
+    if details is None:
+        return False
+
+    details.extra.update(data)
+    return True
+
+
+def attach_trace_rollups(request, route_name=None):
+    """ Summarize the current transaction's traces onto the transaction. """
+
+    transaction = traces.get_transaction()
+
+    if transaction is None:
+        return
+
+    n_plus_one_threshold = int(get_opbeat_setting(
+        request,
+        'n_plus_one_threshold',
+        default=rollups.DEFAULT_N_PLUS_ONE_THRESHOLD,
+    ))
+
+    rollup = rollups.summarize_traces(
+        transaction.transaction_traces,
+        n_plus_one_threshold,
+    )
+
+    annotate_transaction(rollup)
+
+    for query, count in rollup['db.n_plus_one'].items():
+        logger.warning(
+            'Possible N+1 query in %s (%d runs): %s',
+            route_name or get_route_name(request),
+            count,
+            query,
+        )
+
+    return rollup
+
+
+@events.subscriber(events.ApplicationCreated)
+def on_application_created(event):
+    registry = event.app.registry
+
+    if not settings.asbool(get_registry_setting(
+        registry,
+        'enabled',
+        default=False,
+    )):
+        return
+
+    compile_ignore_rules(registry)
+
+    if settings.asbool(get_registry_setting(
+        registry,
+        'flush_on_exit',
+        default=True,
+    )):
+        install_shutdown_hooks(registry)
+
+    if is_propagation_enabled(registry):
+        propagation.instrument()
+
+    # Allocations made before tracing starts can't be attributed later.
+    if settings.asbool(get_registry_setting(
+        registry,
+        'resources.allocations',
+        default=False,
+    )):
+        resources.start_tracing_allocations()
+
+
+def create_sampler(request):
+    seed = get_opbeat_setting(request, 'sampling.seed', default=None)
+
+    return sampling.AdaptiveSampler(
+        target_events_per_second=float(get_opbeat_setting(
+            request,
+            'sampling.target_events_per_second',
+            default=0,
+        )),
+        max_overhead=float(get_opbeat_setting(
+            request,
+            'sampling.max_overhead',
+            default=0,
+        )),
+        min_per_route=int(get_opbeat_setting(
+            request,
+            'sampling.min_per_route',
+            default=sampling.DEFAULT_MIN_PER_ROUTE,
+        )),
+        window=float(get_opbeat_setting(
+            request,
+            'sampling.window',
+            default=sampling.DEFAULT_WINDOW,
+        )),
+        min_rate=float(get_opbeat_setting(
+            request,
+            'sampling.min_rate',
+            default=sampling.DEFAULT_MIN_RATE,
+        )),
+        rare_route_share=float(get_opbeat_setting(
+            request,
+            'sampling.rare_route_share',
+            default=sampling.DEFAULT_RARE_ROUTE_SHARE,
+        )),
+        seed=int(seed) if seed is not None else None,
+    )
+
+
+def get_sampler(request):
+    """ Get the adaptive sampler, or None when sampling is disabled. """
+
+    registry = request.registry
+
+    if not hasattr(registry, '_opbeat_sampler'):
+        if setting_is_enabled(request, 'sampling.enabled'):
+            registry._opbeat_sampler = create_sampler(request)
+        else:
+            registry._opbeat_sampler = None
+
+    return registry._opbeat_sampler
+
+
+def should_sample(request):
+    sampler = get_sampler(request)
+
+    if sampler is None:
+        return True
+
+    # Requests haven't been routed yet, so routes are told apart by path.
+    path_key = None
+    if sampler.min_per_route:
+        path_key = sampling.get_path_key(request.path_info)
+
+    return sampler.should_sample(path_key)
+
+
+def record_overhead(request, started):
+    sampler = getattr(request.registry, '_opbeat_sampler', None)
+
+    if sampler is not None:
+        sampler.record_overhead(sampling.timer() - started)
+
+
+def is_propagation_enabled(registry):
+    return settings.asbool(get_registry_setting(
+        registry,
+        'propagate_trace_context',
+        default=False,
+    ))
+
+
+def get_trace_context(request):
+    if not is_propagation_enabled(request.registry):
+        return None
+
+    return propagation.context_from_environ(
+        request.environ,
+        sampled=functools.partial(should_sample, request),
+    )
+
+
+def link_trace_context(context):
+    if context is None:
+        return
+
+    annotate_transaction({
+        'trace.id': context.trace_id,
+        'trace.parent_id': context.parent_id,
+        'trace.span_id': context.span_id,
+    })
+
+
+def start_resource_usage(request):
+    """ Start measuring the resources used by a request, if enabled. """
+
+    cpu_time = setting_is_enabled(request, 'resources.cpu_time')
+    gc_pauses = setting_is_enabled(request, 'resources.gc')
+    allocations = setting_is_enabled(request, 'resources.allocations')
+
+    if not (cpu_time or gc_pauses or allocations):
+        return None
+
+    return resources.ResourceUsage(
+        cpu_time=cpu_time,
+        gc_pauses=gc_pauses,
+        allocations=allocations,
+    )
+
+
+def begin_transaction(request, kind, state=None):
+    """ Begin a transaction for the given request unless it is unsampled.
+
+    The transaction's client and context are stored on `state`, which
+    defaults to the request itself.
+    """
+
+    if state is None:
+        state = request
+
+    state._opbeat_client = None
+    state._opbeat_resource_usage = None
+
+    context = state._opbeat_trace_context = get_trace_context(request)
+    propagation.set_current_context(context)
+
+    if context is not None:
+        # Upstream services may have already decided whether to sample.
+        sampled = context.sampled
+    else:
+        sampled = should_sample(request)
+
+    if not sampled:
+        return None
+
+    client = state._opbeat_client = opbeat_client_factory(request)
+    client.begin_transaction(kind)
+    link_trace_context(context)
+
+    state._opbeat_resource_usage = start_resource_usage(request)
+
+    return client
+
+
+def end_transaction(request, route_name, status_code, state=None):
+    """ End the transaction started by `begin_transaction`, if any. """
+
+    if state is None:
+        state = request
+
+    propagation.set_current_context(None)
+
+    client, state._opbeat_client = (
+        getattr(state, '_opbeat_client', None),
+        None,
+    )
+
+    if not client:
+        return
+
+    transaction_buffer = get_transaction_buffer(request)
+
+    transaction = traces.get_transaction()
+    details = None
+
+    if not transaction_buffer.admit(route_name, status_code):
+        route_name = transaction_buffer.overflow_route_name
+        drop_transaction_traces()
+
+    else:
+        resource_usage = getattr(state, '_opbeat_resource_usage', None)
+        if resource_usage is not None:
+            annotate_transaction(resource_usage.finish())
+
+        if settings.asbool(get_opbeat_setting(
+            request,
+            'trace_rollups',
+            default=True,
+        )):
+            attach_trace_rollups(request, route_name)
+
+        if transaction is not None:
+            details = getattr(transaction, '_opbeat_details_trace', None)
+
+    client.end_transaction(route_name, status_code)
+
+    if details is not None:
+        add_details_to_totals(client, details)
+
+    # The client empties its store whenever it flushes on its own schedule.
+    if not len(client.instrumentation_store):
+        transaction_buffer.clear()
+
+    elif transaction_buffer.should_flush():
+        get_background_flusher(
+            request,
+            client,
+            transaction_buffer,
+        ).request_flush()
+
+
 @events.subscriber(events.NewRequest)
 def on_request_begin(event):
     request = event.request
 
+    end_abandoned_transaction()
+
     if not is_opbeat_enabled(request):
         return
 
-    client = request._opbeat_client = opbeat_client_factory(request)
-    client.begin_transaction(get_request_module_name(request))
+    if should_skip_transaction(request):
+        return
+
+    started = sampling.timer()
+
     request.add_finished_callback(on_request_finished)
+    begin_transaction(request, get_request_module_name(request))
+
+    record_overhead(request, started)
 
 
 def on_request_finished(request):
+    if not getattr(request, '_opbeat_client', None):
+        propagation.set_current_context(None)
+        return
+
+    # The transaction ends once the response body has been sent instead.
+    if getattr(request, '_opbeat_response_timer', None):
+        return
+
+    started = sampling.timer()
+
+    end_transaction(
+        request,
+        get_route_name(request),
+        get_status_code(request),
+    )
+
+    record_overhead(request, started)
+
+
+def on_response_body_sent(request, timer):
+    if getattr(pending_response, 'request', None) is request:
+        pending_response.request = None
+
+    # It may have already ended as abandoned.
     if not getattr(request, '_opbeat_client', None):
         return
 
-    route_name = get_route_name(request)
-    status_code = get_status_code(request)
+    started = sampling.timer()
+
+    annotate_transaction(timer.as_dict())
+
+    end_transaction(
+        request,
+        get_route_name(request),
+        get_status_code(request),
+    )
 
-    request._opbeat_client.end_transaction(route_name, status_code)
+    record_overhead(request, started)
@@ -2,11 +2,17 @@ import collections
 import functools
 import mock
 import os
+import time
 import unittest
 
+from opbeat import traces
+
 from pyramid import httpexceptions
 from pyramid import testing
+from pyramid.request import Request
+from pyramid.response import Response
 
+from opbeat_pyramid import capture
 from opbeat_pyramid import subscribers
 
 
@@ -67,6 +73,13 @@ class OpbeatSubscribersTestCase(unittest.TestCase):
         del os.environ['OPBEAT_MOCK_ENV_SETTING']
         del os.environ['MOCK_ENV_SETTING']
 
+        subscribers.pending_response.request = None
+
+    def make_real_client(self):
+        # Real clients are only used to inspect what they would send.
+        with mock.patch.dict(os.environ, {'OPBEAT_DISABLE_SEND': 'true'}):
+            return subscribers.opbeat_client_factory(self.request)
+
     def test_get_opbeat_setting_gets_value_from_request_settings(self):
         value = subscribers.get_opbeat_setting(self.request, SETTING_NAME)
         self.assertIs(value, EXPECTED_VALUE)
@@ -461,3 +474,695 @@ class OpbeatSubscribersTestCase(unittest.TestCase):
         subscribers.on_request_finished(self.request)
 
         client.end_transaction.assert_not_called()
+
+    @mock.patch('opbeat.Client')
+    def test_on_request_finished_reports_overflow_under_overflow_name(self, _):
+        client = mock.MagicMock()
+        self.request._opbeat_client = client
+
+        self.settings['opbeat.transaction_buffer.max_groups'] = '1'
+        self.settings['opbeat.transaction_buffer.max_pending'] = '100'
+
+        subscribers.get_transaction_buffer(self.request).admit('other', 200)
+        subscribers.on_request_finished(self.request)
+
+        client.end_transaction.assert_called_once_with('Overflow', 200)
+
+    @mock.patch('opbeat.Client')
+    def test_on_request_finished_flushes_at_high_water_mark(self, Client):
+        client = mock.MagicMock()
+        client.instrumentation_store.__len__.return_value = 1
+        self.request._opbeat_client = client
+
+        self.settings['opbeat.transaction_buffer.max_pending'] = '1'
+
+        with mock.patch(
+            'opbeat_pyramid.buffering.BackgroundFlusher.request_flush',
+        ) as request_flush:
+            subscribers.on_request_finished(self.request)
+
+        request_flush.assert_called_once_with()
+        client._traces_collect.assert_not_called()
+
+    def test_flush_transactions_collects_and_clears_the_buffer(self):
+        client = mock.MagicMock()
+        transaction_buffer = subscribers.get_transaction_buffer(self.request)
+        transaction_buffer.admit('mock.route', 200)
+
+        subscribers.flush_transactions(client, transaction_buffer)
+
+        client._traces_collect.assert_called_once_with()
+        self.assertEqual(transaction_buffer.pending, 0)
+        self.assertEqual(transaction_buffer.flushes, 1)
+
+    def test_overflowing_transactions_only_record_their_duration(self):
+        client = self.make_real_client()
+        self.settings['opbeat.transaction_buffer.max_groups'] = '1'
+        self.settings['opbeat.propagate_trace_context'] = 'false'
+
+        for route_name in ('first', 'second'):
+            subscribers.begin_transaction(self.request, 'web')
+
+            with traces.trace('SELECT 1', 'db.postgresql.query'):
+                pass
+
+            subscribers.end_transaction(self.request, route_name, 200)
+
+        transactions, trace_groups = client.instrumentation_store.get_all()
+
+        self.assertEqual(
+            sorted(item['transaction'] for item in transactions),
+            ['Overflow', 'first'],
+        )
+
+        self.assertEqual(
+            set(group['transaction'] for group in trace_groups),
+            {'first'},
+        )
+
+    def test_get_opbeat_metrics_measures_the_client_store(self):
+        client = self.make_real_client()
+        empty = subscribers.get_opbeat_metrics(self.request)
+
+        client.begin_transaction('web')
+        client.end_transaction('mock.route', 200)
+
+        metrics = subscribers.get_opbeat_metrics(self.request)
+        self.assertGreater(
+            metrics['transaction_buffer.memory_bytes'],
+            empty['transaction_buffer.memory_bytes'],
+        )
+
+    def test_get_transaction_buffer_caches_by_app_id(self):
+        first = subscribers.get_transaction_buffer(self.request)
+        self.assertIs(first, subscribers.get_transaction_buffer(self.request))
+
+        self.settings['opbeat.app_id'] = 'Another App ID'
+        self.assertIsNot(first, subscribers.get_transaction_buffer(
+            self.request,
+        ))
+
+    def test_get_opbeat_metrics_includes_transaction_buffer_metrics(self):
+        metrics = subscribers.get_opbeat_metrics(self.request)
+        self.assertIn('transaction_buffer.memory_bytes', metrics)
+
+    @mock.patch('opbeat.traces.get_transaction')
+    def test_attach_trace_rollups_adds_rollup_to_details_trace(self, get):
+        query = mock.MagicMock()
+        query.kind = 'db.postgresql.sql'
+        query.trace_duration = 4.0
+        query.extra = {'sql': 'SELECT * FROM users WHERE id = 1'}
+
+        transaction = get.return_value = traces.Transaction(
+            time.time(),
+            list,
+            client=None,
+        )
+
+        transaction.transaction_traces = [query, query]
+
+        self.settings['opbeat.n_plus_one_threshold'] = '1'
+        subscribers.attach_trace_rollups(self.request)
+
+        details = subscribers.get_details_trace(transaction)
+        self.assertIs(transaction.transaction_traces[-1], details)
+        self.assertEqual(details.kind, subscribers.DETAILS_TRACE_KIND)
+        self.assertEqual(details.extra['db.count'], 2)
+        self.assertEqual(details.extra['db.duration'], 8.0)
+        self.assertEqual(details.extra['db.n_plus_one'], {
+            'SELECT * FROM users WHERE id = ?': 2,
+        })
+
+    def test_annotations_are_added_up_for_every_transaction(self):
+        client = self.make_real_client()
+        self.settings['opbeat.trace_rollups'] = 'false'
+        self.settings['opbeat.propagate_trace_context'] = 'true'
+
+        for trace_id in ('1', '2', '3'):
+            self.request.environ['HTTP_TRACEPARENT'] = (
+                '00-' + trace_id.zfill(32) + '-' + '1'.zfill(16) + '-01'
+            )
+
+            subscribers.begin_transaction(self.request, 'web')
+            subscribers.annotate_transaction({'mock.value': int(trace_id)})
+            subscribers.end_transaction(self.request, 'mock.route', 200)
+
+        transactions, trace_groups = client.instrumentation_store.get_all()
+
+        details = [
+            group['extra'] for group in trace_groups
+            if group['kind'] == subscribers.DETAILS_TRACE_KIND
+        ]
+
+        self.assertEqual(len(transactions), 1)
+        self.assertEqual(len(details), 1)
+        self.assertEqual(details[0]['transactions'], 3)
+        self.assertEqual(details[0]['mock.value'], 6)
+        self.assertEqual(details[0]['trace.id'], '3'.zfill(32))
+
+    def test_trace_groups_do_not_grow_with_requests_on_one_route(self):
+        client = self.make_real_client()
+        store = client.instrumentation_store
+
+        def run_requests(count):
+            for _ in range(count):
+                subscribers.begin_transaction(self.request, 'web')
+                subscribers.end_transaction(self.request, 'mock.route', 200)
+
+        run_requests(1)
+        groups = len(store._traces)
+
+        run_requests(200)
+
+        self.assertEqual(len(store._traces), groups)
+        self.assertLessEqual(groups, 2)
+
+    def test_annotate_transaction_without_a_transaction(self):
+        self.assertFalse(subscribers.annotate_transaction({'mock': 1}))
+
+    @mock.patch('opbeat.traces.get_transaction')
+    def test_attach_trace_rollups_without_a_transaction(self, get):
+        get.return_value = None
+        self.assertIsNone(subscribers.attach_trace_rollups(self.request))
+
+    @mock.patch('opbeat_pyramid.subscribers.attach_trace_rollups')
+    def test_on_request_finished_can_disable_trace_rollups(self, attach):
+        self.request._opbeat_client = mock.MagicMock()
+
+        subscribers.on_request_finished(self.request)
+        attach.assert_called_once_with(self.request, 'mock.example_view')
+
+        attach.reset_mock()
+        self.settings['opbeat.trace_rollups'] = 'false'
+        subscribers.on_request_finished(self.request)
+        attach.assert_not_called()
+
+    @mock.patch('opbeat.Client')
+    def test_on_request_begin_skips_traces_unsampled_upstream(self, Client):
+        self.settings['opbeat.propagate_trace_context'] = 'true'
+        client = mock.MagicMock()
+        Client.return_value = client
+
+        self.request.add_finished_callback = mock.MagicMock()
+        self.request.environ['HTTP_TRACEPARENT'] = (
+            '00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-00'
+        )
+
+        subscribers.on_request_begin(MockRequestEvent(self.request))
+
+        client.begin_transaction.assert_not_called()
+        self.assertFalse(self.request._opbeat_trace_context.sampled)
+        self.assertIs(
+            subscribers.propagation.get_current_context(),
+            self.request._opbeat_trace_context,
+        )
+
+        subscribers.on_request_finished(self.request)
+        self.assertIsNone(subscribers.propagation.get_current_context())
+
+    @mock.patch('opbeat.Client')
+    @mock.patch('opbeat_pyramid.subscribers.annotate_transaction')
+    def test_on_request_begin_links_upstream_trace(self, annotate, Client):
+        self.settings['opbeat.propagate_trace_context'] = 'true'
+        self.request.add_finished_callback = mock.MagicMock()
+        self.request.environ['HTTP_TRACEPARENT'] = (
+            '00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01'
+        )
+
+        subscribers.on_request_begin(MockRequestEvent(self.request))
+
+        Client.return_value.begin_transaction.assert_called_once()
+        annotation = annotate.call_args[0][0]
+        self.assertEqual(
+            annotation['trace.id'],
+            '4bf92f3577b34da6a3ce929d0e0e4736',
+        )
+        self.assertEqual(annotation['trace.parent_id'], '00f067aa0ba902b7')
+
+    def test_get_trace_context_can_be_disabled(self):
+        self.settings['opbeat.propagate_trace_context'] = 'false'
+        self.assertIsNone(subscribers.get_trace_context(self.request))
+
+    @mock.patch('opbeat.Client')
+    def test_trace_context_is_ignored_by_default(self, Client):
+        self.request.environ['HTTP_TRACEPARENT'] = (
+            '00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-00'
+        )
+
+        self.assertIsNone(subscribers.get_trace_context(self.request))
+        self.assertIs(
+            subscribers.begin_transaction(self.request, 'web'),
+            Client.return_value,
+        )
+
+    @mock.patch('opbeat_pyramid.propagation.instrument')
+    def test_on_application_created_patches_urllib3_if_enabled(self,
+                                                               instrument):
+        self.settings['opbeat.flush_on_exit'] = 'false'
+
+        event = mock.MagicMock()
+        event.app.registry = self.request.registry
+
+        subscribers.on_application_created(event)
+        instrument.assert_not_called()
+
+        self.settings['opbeat.propagate_trace_context'] = 'true'
+
+        subscribers.on_application_created(event)
+        instrument.assert_called_once_with()
+
+    @mock.patch('opbeat.Client')
+    def test_begin_and_end_transaction_use_the_given_names(self, Client):
+        client = mock.MagicMock()
+        Client.return_value = client
+
+        self.assertIs(subscribers.begin_transaction(self.request, 'task'),
+                      client)
+        client.begin_transaction.assert_called_once_with('task')
+
+        subscribers.end_transaction(self.request, 'mock.job', 'success')
+        client.end_transaction.assert_called_once_with('mock.job', 'success')
+
+    @mock.patch('opbeat_pyramid.shutdown.ShutdownFlusher.install')
+    def test_on_application_created_installs_shutdown_hooks(self, install):
+        self.settings['opbeat.shutdown_signals'] = 'SIGTERM, SIGINT'
+        self.settings['opbeat.shutdown_timeout'] = '2.5'
+
+        event = mock.MagicMock()
+        event.app.registry = self.request.registry
+
+        subscribers.on_application_created(event)
+        subscribers.on_application_created(event)
+
+        install.assert_called_once_with(['SIGTERM', 'SIGINT'])
+        flusher = self.request.registry._opbeat_shutdown_flusher
+        self.assertEqual(flusher.timeout, 2.5)
+
+    @mock.patch('opbeat_pyramid.shutdown.ShutdownFlusher.install')
+    def test_on_application_created_can_disable_flush_on_exit(self, install):
+        self.settings['opbeat.flush_on_exit'] = 'false'
+
+        event = mock.MagicMock()
+        event.app.registry = self.request.registry
+
+        subscribers.on_application_created(event)
+        install.assert_not_called()
+
+    @mock.patch('opbeat.Client')
+    def test_flush_opbeat_clients_flushes_cached_clients(self, Client):
+        client = mock.MagicMock()
+        client.instrumentation_store.__len__.return_value = 3
+        Client.return_value = client
+
+        subscribers.opbeat_client_factory(self.request)
+
+        result = subscribers.flush_opbeat_clients(self.request.registry)
+
+        self.assertEqual(result, (3, 0))
+        client._traces_collect.assert_called_once_with()
+
+    @mock.patch('opbeat.Client')
+    def test_create_opbeat_client_uses_servers_setting(self, Client):
+        subscribers.create_opbeat_client(self.request, MOCK_APP_ID)
+        self.assertIsNone(Client.call_args[1]['servers'])
+
+        self.settings['opbeat.servers'] = 'http://a.example,http://b.example'
+        subscribers.create_opbeat_client(self.request, MOCK_APP_ID)
+        self.assertEqual(Client.call_args[1]['servers'], [
+            'http://a.example',
+            'http://b.example',
+        ])
+
+    def test_opbeat_tween_times_response_bodies_when_enabled(self):
+        self.settings['opbeat.time_response_body'] = 'true'
+        self.request._opbeat_client = mock.MagicMock()
+
+        response = mock.MagicMock()
+        response.app_iter = [b'chunk']
+
+        handler = mock.MagicMock()
+        handler.return_value = response
+
+        subscribers.opbeat_tween(handler, self.request.registry, self.request)
+
+        self.assertIs(response.app_iter, self.request._opbeat_response_timer)
+        self.assertEqual(list(response.app_iter), [b'chunk'])
+
+    def test_timed_response_bodies_keep_content_length_and_ranges(self):
+        self.settings['opbeat.time_response_body'] = 'true'
+        self.request._opbeat_client = client = mock.MagicMock()
+
+        handler = mock.MagicMock()
+        handler.return_value = Response(
+            body=b'x' * 1000,
+            conditional_response=True,
+        )
+
+        response = subscribers.opbeat_tween(
+            handler,
+            self.request.registry,
+            self.request,
+        )
+
+        self.assertIs(response.app_iter, self.request._opbeat_response_timer)
+        self.assertEqual(response.content_length, 1000)
+
+        ranged = Request.blank('/', range='bytes=0-9').get_response(response)
+
+        self.assertEqual(ranged.status_code, 206)
+        self.assertEqual(ranged.content_length, 10)
+        self.assertEqual(ranged.body, b'x' * 10)
+
+        client.end_transaction.assert_called_once_with(
+            'mock.example_view',
+            200,
+        )
+
+    def test_opbeat_tween_does_not_time_response_bodies_by_default(self):
+        self.request._opbeat_client = mock.MagicMock()
+
+        response = mock.MagicMock()
+        response.app_iter = app_iter = [b'chunk']
+
+        handler = mock.MagicMock()
+        handler.return_value = response
+
+        subscribers.opbeat_tween(handler, self.request.registry, self.request)
+        self.assertIs(response.app_iter, app_iter)
+
+    @mock.patch('opbeat_pyramid.subscribers.annotate_transaction')
+    def test_timed_responses_end_transactions_once_sent(self, annotate):
+        client = mock.MagicMock()
+        self.request._opbeat_client = client
+        self.request._opbeat_response_timer = timer = mock.MagicMock()
+
+        subscribers.on_request_finished(self.request)
+        client.end_transaction.assert_not_called()
+
+        subscribers.on_response_body_sent(self.request, timer)
+
+        annotate.assert_called_once_with(timer.as_dict.return_value)
+        client.end_transaction.assert_called_once_with(
+            'mock.example_view',
+            200,
+        )
+
+    @mock.patch('opbeat_pyramid.subscribers.annotate_transaction')
+    def test_unclosed_response_bodies_end_with_the_next_request(
+        self,
+        annotate,
+    ):
+        self.settings['opbeat.time_response_body'] = 'true'
+        self.request._opbeat_client = client = mock.MagicMock()
+
+        response = mock.MagicMock()
+        response.app_iter = [b'chunk']
+
+        handler = mock.MagicMock()
+        handler.return_value = response
+
+        subscribers.opbeat_tween(handler, self.request.registry, self.request)
+        subscribers.on_request_finished(self.request)
+        client.end_transaction.assert_not_called()
+
+        next_request = mock.MagicMock()
+        next_request.registry.settings = {'opbeat.enabled': 'false'}
+        subscribers.on_request_begin(mock.MagicMock(request=next_request))
+
+        self.assertFalse(annotate.call_args[0][0]['response.closed'])
+        client.end_transaction.assert_called_once_with(
+            'mock.example_view',
+            200,
+        )
+
+        # Closing it late doesn't end it, or any other transaction, again.
+        response.app_iter.close()
+        self.assertEqual(client.end_transaction.call_count, 1)
+        self.assertEqual(annotate.call_count, 1)
+
+    @mock.patch('opbeat_pyramid.subscribers.annotate_transaction')
+    def test_closed_response_bodies_are_not_ended_again(self, annotate):
+        self.settings['opbeat.time_response_body'] = 'true'
+        self.request._opbeat_client = client = mock.MagicMock()
+
+        response = mock.MagicMock()
+        response.app_iter = [b'chunk']
+
+        handler = mock.MagicMock()
+        handler.return_value = response
+
+        subscribers.opbeat_tween(handler, self.request.registry, self.request)
+        response.app_iter.close()
+        subscribers.end_abandoned_transaction()
+
+        client.end_transaction.assert_called_once_with(
+            'mock.example_view',
+            200,
+        )
+
+    @mock.patch('opbeat.Client')
+    def test_capture_exception_applies_capture_limits(self, Client):
+        client = mock.MagicMock()
+        Client.return_value = client
+
+        self.settings['opbeat.capture.locals'] = 'off'
+        self.settings['opbeat.capture.max_frames'] = '1'
+        self.settings['opbeat.capture.max_string_length'] = '5'
+
+        try:
+            raise ValueError()
+        except ValueError:
+            exc_info = subscribers.sys.exc_info()
+
+        subscribers.capture_exception(self.request, exc_info, {
+            'url': 'https://example.com/a/long/url',
+        })
+
+        args, kwargs = client.capture_exception.call_args
+        self.assertIsNot(args[0], exc_info)
+        self.assertEqual(args[0][2].tb_frame.f_locals, {})
+        self.assertIsNone(args[0][2].tb_next)
+        self.assertEqual(kwargs['extra'], {'url': 'https...'})
+        self.assertEqual(Client.call_args[1]['string_max_length'], 5)
+
+    def test_get_locals_mode_rejects_unknown_modes(self):
+        self.settings['opbeat.capture.locals'] = 'everything'
+        self.assertRaises(
+            ValueError,
+            subscribers.get_locals_mode,
+            self.request,
+        )
+
+    @mock.patch('opbeat.Client')
+    def test_capture_exception_can_send_in_the_background(self, Client):
+        client = mock.MagicMock()
+        Client.return_value = client
+
+        self.settings['opbeat.capture.in_background'] = 'true'
+        mock_exc_info = [None, ValueError()]
+
+        result = subscribers.capture_exception(
+            self.request,
+            mock_exc_info,
+            extra={},
+        )
+
+        self.assertIsNone(result)
+
+        worker = subscribers.get_capture_worker(self.request)
+        self.assertTrue(worker.drain(1))
+        client.capture_exception.assert_called_once()
+
+    @mock.patch('opbeat_pyramid.subscribers.get_capture_worker')
+    @mock.patch('opbeat.Client')
+    def test_background_captures_never_receive_live_frames(self, _, get):
+        self.settings['opbeat.capture.in_background'] = 'true'
+
+        try:
+            raise ValueError()
+        except ValueError:
+            exc_info = subscribers.sys.exc_info()
+
+        subscribers.capture_exception(self.request, exc_info, extra={})
+
+        sent_exc_info = get.return_value.submit.call_args[0][2]
+        traceback = sent_exc_info[2]
+
+        self.assertIsNotNone(traceback)
+
+        while traceback is not None:
+            self.assertIsInstance(traceback, capture.CapturedTraceback)
+            self.assertIsInstance(traceback.tb_frame, capture.CapturedFrame)
+            traceback = traceback.tb_next
+
+    def test_should_ignore_exception_uses_ignore_rules(self):
+        self.settings['opbeat.ignore'] = '\n'.join([
+            'path:/static/* status:404',
+            'exception:builtins.KeyError',
+        ])
+
+        self.request.path = '/static/app.css'
+        not_found = [None, httpexceptions.HTTPNotFound()]
+
+        self.assertTrue(subscribers.should_ignore_exception(
+            self.request,
+            not_found,
+        ))
+
+        self.assertTrue(subscribers.should_ignore_exception(
+            self.request,
+            [KeyError, KeyError()],
+        ))
+
+        self.assertFalse(subscribers.should_ignore_exception(
+            self.request,
+            [ValueError, ValueError()],
+        ))
+
+        self.request.path = '/api/users'
+        self.assertFalse(subscribers.should_ignore_exception(
+            self.request,
+            not_found,
+        ))
+
+    def test_ignore_rules_are_compiled_once(self):
+        self.settings['opbeat.ignore'] = 'status:404'
+
+        matcher = subscribers.get_ignore_rules(self.request)
+        self.assertIs(matcher, subscribers.get_ignore_rules(self.request))
+
+    @mock.patch('opbeat.Client')
+    def test_on_request_begin_skips_matching_transactions(self, Client):
+        client = mock.MagicMock()
+        Client.return_value = client
+
+        self.settings['opbeat.skip_transactions'] = 'path:/health'
+        self.request.path = '/health'
+        self.request.add_finished_callback = mock.MagicMock()
+
+        subscribers.on_request_begin(MockRequestEvent(self.request))
+
+        client.begin_transaction.assert_not_called()
+        self.request.add_finished_callback.assert_not_called()
+
+    def test_compile_ignore_rules_rejects_invalid_skip_rules(self):
+        self.settings['opbeat.skip_transactions'] = 'status:200'
+
+        self.assertRaises(
+            ValueError,
+            subscribers.compile_ignore_rules,
+            self.request.registry,
+        )
+
+    def test_get_sampler_is_none_unless_sampling_is_enabled(self):
+        self.assertIsNone(subscribers.get_sampler(self.request))
+        self.assertTrue(subscribers.should_sample(self.request))
+
+    def test_get_sampler_creates_a_sampler_from_settings(self):
+        self.settings['opbeat.sampling.enabled'] = 'true'
+        self.settings['opbeat.sampling.target_events_per_second'] = '5'
+        self.settings['opbeat.sampling.seed'] = '42'
+
+        sampler = subscribers.get_sampler(self.request)
+
+        self.assertEqual(sampler.target_events_per_second, 5.0)
+        self.assertIs(sampler, subscribers.get_sampler(self.request))
+        self.assertIn('sampling.rate', subscribers.get_opbeat_metrics(
+            self.request,
+        ))
+
+    @mock.patch('opbeat.Client')
+    def test_begin_transaction_skips_requests_which_are_not_sampled(self, _):
+        self.settings['opbeat.sampling.enabled'] = 'true'
+        self.settings['opbeat.propagate_trace_context'] = 'false'
+
+        sampler = subscribers.get_sampler(self.request)
+        sampler.rate = 0.0
+        sampler.min_per_route = 0
+
+        self.assertIsNone(subscribers.begin_transaction(self.request, 'web'))
+
+    def test_sampling_decisions_are_propagated_downstream(self):
+        self.settings['opbeat.propagate_trace_context'] = 'true'
+        self.settings['opbeat.sampling.enabled'] = 'true'
+
+        sampler = subscribers.get_sampler(self.request)
+        sampler.rate = 0.0
+        sampler.min_per_route = 0
+
+        context = subscribers.get_trace_context(self.request)
+        self.assertFalse(context.sampled)
+
+    def test_rare_paths_are_sampled_by_their_path_key(self):
+        self.settings['opbeat.sampling.enabled'] = 'true'
+
+        sampler = subscribers.get_sampler(self.request)
+        sampler.rate = 0.0
+
+        self.request.path_info = '/users/1'
+        self.assertTrue(subscribers.should_sample(self.request))
+
+        self.request.path_info = '/users/2'
+        self.assertFalse(subscribers.should_sample(self.request))
+
+        self.request.path_info = '/teams/2'
+        self.assertTrue(subscribers.should_sample(self.request))
+
+    def test_unique_paths_do_not_break_the_sampling_budget(self):
+        self.settings['opbeat.sampling.enabled'] = 'true'
+        self.settings['opbeat.sampling.target_events_per_second'] = '1'
+        self.settings['opbeat.sampling.seed'] = '1'
+
+        sampler = subscribers.get_sampler(self.request)
+        sampler.rate = 0.001
+
+        sampled = 0
+        for index in range(2000):
+            # Slugs without digits, so each path is its own key.
+            slug = ''.join(chr(ord('a') + int(digit)) for digit in str(index))
+            self.request.path_info = '/articles/how-to-cook-' + slug
+
+            sampled += subscribers.should_sample(self.request)
+
+        self.assertLessEqual(sampled, 10)
+
+    def test_start_resource_usage_is_none_unless_enabled(self):
+        self.assertIsNone(subscribers.start_resource_usage(self.request))
+
+    @mock.patch('opbeat_pyramid.subscribers.annotate_transaction')
+    @mock.patch('opbeat.Client')
+    def test_transactions_report_resource_usage_when_enabled(self, Client,
+                                                             annotate):
+        self.settings['opbeat.resources.cpu_time'] = 'true'
+        self.settings['opbeat.resources.gc'] = 'true'
+        self.settings['opbeat.trace_rollups'] = 'false'
+        self.settings['opbeat.propagate_trace_context'] = 'false'
+
+        subscribers.begin_transaction(self.request, 'web')
+        usage = self.request._opbeat_resource_usage
+
+        self.assertIsNotNone(usage.gc_started_at)
+        self.assertIsNone(usage.memory_started_at)
+
+        subscribers.end_transaction(self.request, 'mock.view', 200)
+
+        data = annotate.call_args[0][0]
+        self.assertIn('resources.wall_time', data)
+        self.assertIn('resources.gc_pause_time', data)
+        self.assertNotIn('resources.allocated_bytes', data)
+
+    @mock.patch('opbeat_pyramid.resources.start_tracing_allocations')
+    def test_on_application_created_traces_allocations_if_enabled(self,
+                                                                  start):
+        self.settings['opbeat.flush_on_exit'] = 'false'
+
+        event = mock.MagicMock()
+        event.app.registry = self.request.registry
+
+        subscribers.on_application_created(event)
+        start.assert_not_called()
+
+        self.settings['opbeat.resources.allocations'] = 'true'
+
+        subscribers.on_application_created(event)
+        start.assert_called_once_with()